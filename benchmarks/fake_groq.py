@@ -0,0 +1,100 @@
+"""Local stand-in for Groq's OpenAI-compatible streaming endpoint.
+
+    python -m benchmarks.fake_groq --port 8100 --token-rate 80 --jitter 0.3 --error-rate 0.02
+
+Point the API at it with GROQ_BASE_URL=http://127.0.0.1:8100.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = ("lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit", "sed", "do")
+
+
+def create_app(token_rate=50.0, jitter=0.2, error_rate=0.0, ttft_ms=150.0, tokens=200, seed=None):
+    """A fake provider emitting `tokens` deltas at `token_rate` per second.
+
+    Each gap is scaled by a uniform factor in [1 - jitter, 1 + jitter], and
+    `error_rate` of requests fail with a 429 carrying rate-limit headers.
+    """
+    app = FastAPI(title="Fake Groq")
+    rng = random.Random(seed)
+    stats = {"requests": 0, "errors": 0, "cancelled": 0}
+
+    def _pause(mean):
+        return max(0.0, mean * rng.uniform(1 - jitter, 1 + jitter))
+
+    def _chunk(completion_id, model, content, finish_reason=None):
+        delta = {"content": content} if content is not None else {}
+        return {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+
+    @app.post("/openai/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        if rng.random() < error_rate:
+            stats["errors"] += 1
+            return JSONResponse(
+                {"error": {"message": "Rate limit reached", "type": "tokens", "code": "rate_limit_exceeded"}},
+                status_code=429,
+                headers={"retry-after": "0.2", "x-ratelimit-reset-requests": "200ms"},
+            )
+
+        model = body.get("model", "fake")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+        async def events():
+            try:
+                await asyncio.sleep(_pause(ttft_ms / 1000))
+                yield f"data: {json.dumps(_chunk(completion_id, model, ''))}\n\n"
+                for index in range(tokens):
+                    if index:
+                        await asyncio.sleep(_pause(1 / token_rate))
+                    word = WORDS[index % len(WORDS)]
+                    yield f"data: {json.dumps(_chunk(completion_id, model, ' ' + word))}\n\n"
+                yield f"data: {json.dumps(_chunk(completion_id, model, None, 'stop'))}\n\n"
+                yield "data: [DONE]\n\n"
+            except asyncio.CancelledError:
+                stats["cancelled"] += 1
+                raise
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--token-rate", type=float, default=50.0, help="deltas per second per stream")
+    parser.add_argument("--jitter", type=float, default=0.2, help="relative spread of each delay")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--ttft-ms", type=float, default=150.0, help="mean delay before the first delta")
+    parser.add_argument("--tokens", type=int, default=200, help="deltas per reply")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    app = create_app(args.token_rate, args.jitter, args.error_rate, args.ttft_ms, args.tokens, args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
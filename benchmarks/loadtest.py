@@ -0,0 +1,224 @@
+"""Load test for the streaming endpoint against a fake provider.
+
+    python -m benchmarks.loadtest --concurrency 50 --requests 500
+
+Starts benchmarks.fake_groq and the API (uvicorn src.main:app) as
+subprocesses, with a local SQLite store and HS256 tokens checked by the
+API's local JWT verification, so no Supabase or Groq account is needed.
+It then drives concurrent SSE clients against
+/api/v1/conversations/{id}/messages/stream. The report covers throughput,
+time to first token, inter-event latency and total latency (p50/p95/p99),
+followed by the server's own /metrics phase histograms.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import jwt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_SECRET = "benchmark-only-secret-benchmark-only-secret"
+BENCH_USER = "00000000-0000-0000-0000-000000000001"
+
+
+def bench_conversation_id(index):
+    return f"00000000-0000-0000-0001-{index:012d}"
+MODEL = "llama3-8b-8192"
+
+
+def percentile(values, q):
+    """Nearest-rank percentile."""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def mint_token():
+    claims = {"sub": BENCH_USER, "aud": "authenticated", "role": "authenticated", "exp": int(time.time()) + 3600}
+    return jwt.encode(claims, BENCH_SECRET, algorithm="HS256")
+
+
+def seed_conversations(path, count):
+    # The API creates the SQLite schema on startup; this only adds the rows
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT OR IGNORE INTO conversations (id, user_id, model) VALUES (?, ?, ?)",
+        [(bench_conversation_id(index), BENCH_USER, MODEL) for index in range(count)],
+    )
+    conn.commit()
+    conn.close()
+
+
+async def wait_until_up(url, process, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{url} exited with status {process.returncode}")
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+async def stream_once(client, base_url, conversation_id, token, prompt):
+    """One streamed reply: (status, ttft, inter-event gaps, total, characters)."""
+    started = time.perf_counter()
+    first = last = None
+    gaps = []
+    chars = 0
+    async with client.stream(
+        "POST",
+        f"{base_url}/api/v1/conversations/{conversation_id}/messages/stream",
+        json={"content": prompt},
+        headers={"Authorization": f"Bearer {token}"},
+    ) as response:
+        if response.status_code != 200:
+            await response.aread()
+            return response.status_code, None, [], time.perf_counter() - started, 0
+        async for line in response.aiter_lines():
+            if not line.startswith('data: {"delta"'):
+                continue
+            now = time.perf_counter()
+            if first is None:
+                first = now
+            else:
+                gaps.append(now - last)
+            last = now
+            chars += len(json.loads(line[6:])["delta"]["text"])
+    ttft = first - started if first is not None else None
+    return 200, ttft, gaps, time.perf_counter() - started, chars
+
+
+async def run_load(base_url, concurrency, total, prompt, timeout):
+    token = mint_token()
+    results = []
+    counter = iter(range(total))
+
+    async def worker(index, client):
+        for _ in counter:
+            try:
+                results.append(await stream_once(client, base_url, bench_conversation_id(index), token, prompt))
+            except httpx.HTTPError as exc:
+                results.append((type(exc).__name__, None, [], 0.0, 0))
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(index, client) for index in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return results, elapsed
+
+
+def report(results, elapsed):
+    ok = [result for result in results if result[0] == 200]
+    failures = {}
+    for result in results:
+        if result[0] != 200:
+            failures[str(result[0])] = failures.get(str(result[0]), 0) + 1
+
+    ttfts = [result[1] * 1000 for result in ok if result[1] is not None]
+    gaps = [gap * 1000 for result in ok for gap in result[2]]
+    totals = [result[3] * 1000 for result in ok]
+    chars = sum(result[4] for result in ok)
+
+    print(f"requests      {len(results)} in {elapsed:.2f}s ({len(ok)} ok, failures: {failures or 'none'})")
+    print(f"throughput    {len(ok) / elapsed:.1f} replies/s, {chars / elapsed:.0f} chars/s")
+    print(f"{'':14}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  (ms)")
+    for name, values in (("ttft", ttfts), ("inter-event", gaps), ("total", totals)):
+        row = [percentile(values, q) for q in (50, 95, 99)] + [max(values) if values else float("nan")]
+        print(f"{name:14}" + "".join(f"{value:10.1f}" for value in row))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--prompt", default="Tell me about benchmarking.")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the API")
+    parser.add_argument("--api-port", type=int, default=8200)
+    parser.add_argument("--fake-port", type=int, default=8100)
+    parser.add_argument("--token-rate", type=float, default=50.0)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--ttft-ms", type=float, default=150.0)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument(
+        "--env", action="append", default=[], metavar="KEY=VALUE",
+        help="extra API environment, e.g. --env SSE_COALESCE_MS=0 --env RESPONSE_CACHE_ENABLED=1",
+    )
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="ai-conversation-bench-")
+    database = os.path.join(workdir, "bench.db")
+
+    env = {
+        **os.environ,
+        "GROQ_API_KEY": "fake",
+        "GROQ_BASE_URL": f"http://127.0.0.1:{args.fake_port}",
+        # Nothing listens here; tokens are verified locally with JWT_SECRET
+        "SUPABASE_URL": "http://127.0.0.1:9",
+        "SUPABASE_ANON_KEY": "fake",
+        "JWT_SECRET": BENCH_SECRET,
+        "AUTH_VERIFY_MODE": "local",
+        "DATABASE_URL": f"sqlite:///{database}",
+        "RATE_LIMIT_REQUESTS": "1000000/second",
+        "RATE_LIMIT_TOKENS": "",
+        "RATE_LIMIT_BACKEND": "shared" if args.workers > 1 else "memory",
+        "RATE_LIMIT_SHM_PATH": os.path.join(workdir, "ratelimit"),
+    }
+    env.update(item.split("=", 1) for item in args.env)
+
+    fake = subprocess.Popen(
+        [
+            sys.executable, "-m", "benchmarks.fake_groq", "--port", str(args.fake_port),
+            "--token-rate", str(args.token_rate), "--jitter", str(args.jitter),
+            "--error-rate", str(args.error_rate), "--ttft-ms", str(args.ttft_ms), "--tokens", str(args.tokens),
+        ],
+        cwd=ROOT,
+    )
+    api = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "src.main:app", "--port", str(args.api_port),
+            "--workers", str(args.workers), "--log-level", "warning",
+        ],
+        cwd=ROOT,
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{args.api_port}"
+
+    async def run():
+        await wait_until_up(f"http://127.0.0.1:{args.fake_port}/stats", fake)
+        await wait_until_up(f"{base_url}/health", api)
+        seed_conversations(database, args.concurrency)
+        results, elapsed = await run_load(base_url, args.concurrency, args.requests, args.prompt, args.timeout)
+        report(results, elapsed)
+        async with httpx.AsyncClient() as client:
+            metrics = (await client.get(f"{base_url}/metrics")).text
+        print("\n# server /metrics" + (" (one worker only)" if args.workers > 1 else ""))
+        print("\n".join(line for line in metrics.splitlines() if "_bucket" not in line and not line.startswith("#")))
+
+    try:
+        asyncio.run(run())
+    finally:
+        for process in (api, fake):
+            process.terminate()
+            process.wait(timeout=10)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
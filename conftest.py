@@ -0,0 +1,24 @@
+import os
+
+import pytest
+
+# Modules build their clients and stores at import time; keep tests offline
+os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:9")
+os.environ.setdefault("SUPABASE_ANON_KEY", "test")
+os.environ.setdefault("GROQ_API_KEY", "test")
+os.environ.setdefault("JWT_SECRET", "test-secret-test-secret-test-secret")
+
+
+class _WordEncoding:
+    """One token per whitespace-separated word, so tests never download tiktoken data."""
+
+    def encode(self, text, disallowed_special=()):
+        return text.split()
+
+
+@pytest.fixture(autouse=True)
+def word_tokens(monkeypatch):
+    from src.messages import tokens
+
+    monkeypatch.setattr(tokens, "_encoding", lambda: _WordEncoding())
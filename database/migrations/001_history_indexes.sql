@@ -0,0 +1,21 @@
+-- Indexes for keyset-paginated history reads and per-user conversation lists.
+-- On a large live table, run each CREATE INDEX as CREATE INDEX CONCURRENTLY
+-- outside a transaction to avoid blocking writes.
+CREATE INDEX IF NOT EXISTS messages_conversation_created_idx
+    ON messages (conversation_id, created_at, id);
+
+CREATE INDEX IF NOT EXISTS conversations_user_updated_idx
+    ON conversations (user_id, updated_at DESC);
+
+-- Wrapping auth.uid() in a sub-select lets Postgres evaluate it once per
+-- statement instead of once per row.
+DROP POLICY IF EXISTS "Allow individual ownership" ON conversations;
+CREATE POLICY "Allow individual ownership" ON conversations FOR ALL USING ((SELECT auth.uid()) = user_id);
+
+-- The caller's conversation ids are collected once (via the index above) and
+-- each message row is checked against that set, instead of running a
+-- correlated EXISTS lookup per row.
+DROP POLICY IF EXISTS "Allow message access" ON messages;
+CREATE POLICY "Allow message access" ON messages FOR ALL USING (
+  conversation_id IN (SELECT id FROM conversations WHERE user_id = (SELECT auth.uid()))
+);
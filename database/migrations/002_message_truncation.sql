@@ -0,0 +1,3 @@
+-- Assistant replies cut short by a client disconnect or upstream failure are
+-- still stored, flagged so they can be told apart from complete answers.
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS is_truncated BOOLEAN DEFAULT false;
@@ -18,14 +18,19 @@ CREATE TABLE messages (
     content TEXT NOT NULL,
     token_count INT,
     latency_ms INT,
+    is_truncated BOOLEAN DEFAULT false,
     created_at TIMESTAMPTZ DEFAULT now()
 );
 
+-- Keyset pagination over a conversation and per-user conversation lists
+CREATE INDEX messages_conversation_created_idx ON messages (conversation_id, created_at, id);
+CREATE INDEX conversations_user_updated_idx ON conversations (user_id, updated_at DESC);
+
 -- Enable RLS so users only see THEIR data
 ALTER TABLE conversations ENABLE ROW LEVEL SECURITY;
-CREATE POLICY "Allow individual ownership" ON conversations FOR ALL USING (auth.uid() = user_id);
+CREATE POLICY "Allow individual ownership" ON conversations FOR ALL USING ((SELECT auth.uid()) = user_id);
 
 ALTER TABLE messages ENABLE ROW LEVEL SECURITY;
 CREATE POLICY "Allow message access" ON messages FOR ALL USING (
-  EXISTS (SELECT 1 FROM conversations WHERE id = messages.conversation_id AND user_id = auth.uid())
+  conversation_id IN (SELECT id FROM conversations WHERE user_id = (SELECT auth.uid()))
 );
\ No newline at end of file
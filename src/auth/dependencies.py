@@ -1,19 +1,72 @@
-from fastapi import Depends, HTTPException, Security
+import time
+from fastapi import Depends, HTTPException, Request, Security
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from supabase import create_client, Client
+import jwt
 import os
 from dotenv import load_dotenv
 
+from src.metrics import timings_for
+from src.auth.tokens import (
+    JWKSCache,
+    LocalVerificationUnavailable,
+    TokenCache,
+    TokenVerifier,
+    VerifiedUser,
+    token_key,
+)
+
 load_dotenv()
 supabase: Client = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_ANON_KEY"))
 security = HTTPBearer()
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Security(security)):
+# "local" checks JWTs in-process and only asks Supabase when no local key fits;
+# "remote" always calls Supabase Auth (still off the event loop, still cached).
+AUTH_VERIFY_MODE = os.getenv("AUTH_VERIFY_MODE", "local")
+
+jwks = JWKSCache(f"{os.getenv('SUPABASE_URL').rstrip('/')}/auth/v1/.well-known/jwks.json")
+verifier = TokenVerifier(secret=os.getenv("JWT_SECRET"), jwks=jwks)
+token_cache = TokenCache()
+
+
+async def _verify_remote(token):
+    # supabase-py is synchronous; keep the round trip off the event loop
+    response = await run_in_threadpool(supabase.auth.get_user, token)
+    if not response or not response.user:
+        raise HTTPException(status_code=401, detail="Invalid session")
+    claims = jwt.decode(token, options={"verify_signature": False})
+    return response.user, claims["exp"]
+
+
+async def get_current_user(request: Request, credentials: HTTPAuthorizationCredentials = Security(security)):
+    timings = timings_for(request)
+    started = time.perf_counter()
     try:
-        # Validate the token with Supabase Auth
-        user = supabase.auth.get_user(credentials.credentials)
-        if not user:
-            raise HTTPException(status_code=401, detail="Invalid session")
-        return user.user
+        return await _authenticate(credentials.credentials)
+    finally:
+        timings.record("auth", time.perf_counter() - started)
+
+
+async def _authenticate(token):
+    key = token_key(token)
+    user = token_cache.get(key)
+    if user is not None:
+        return user
+
+    try:
+        if AUTH_VERIFY_MODE == "local":
+            try:
+                claims = await verifier.verify(token)
+                user, expires_at = VerifiedUser(claims), claims["exp"]
+            except LocalVerificationUnavailable:
+                user, expires_at = await _verify_remote(token)
+        else:
+            user, expires_at = await _verify_remote(token)
+    except HTTPException:
+        raise
     except Exception:
-        raise HTTPException(status_code=401, detail="Unauthorized")
\ No newline at end of file
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    token_cache.put(key, user, expires_at)
+    return user
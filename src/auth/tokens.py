@@ -0,0 +1,178 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import httpx
+import jwt
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+JWT_AUDIENCE = os.getenv("SUPABASE_JWT_AUDIENCE", "authenticated")
+JWKS_REFRESH_SECONDS = float(os.getenv("SUPABASE_JWKS_REFRESH_SECONDS", "600"))
+# Unknown `kid`s trigger an on-demand refresh, but never more often than this
+JWKS_MIN_REFRESH_SECONDS = 30.0
+TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+ASYMMETRIC_ALGORITHMS = ("RS256", "ES256", "EdDSA")
+
+
+class LocalVerificationUnavailable(Exception):
+    """No local key can check this token; the caller should ask Supabase."""
+
+
+class VerifiedUser:
+    """The subset of the Supabase `User` the API relies on, built from JWT claims."""
+
+    def __init__(self, claims):
+        self.id = claims["sub"]
+        self.email = claims.get("email")
+        self.role = claims.get("role")
+        self.app_metadata = claims.get("app_metadata") or {}
+        self.claims = claims
+
+
+def token_key(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class TokenCache:
+    """LRU cache of verified users, each entry dropped at its token's `exp`."""
+
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        user, expires_at = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return user
+
+    def put(self, key, user, expires_at):
+        if expires_at <= time.time():
+            return
+        self._entries[key] = (user, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class JWKSCache:
+    """Supabase signing keys, refreshed in the background and on unknown `kid`s."""
+
+    def __init__(self, url, refresh_seconds=JWKS_REFRESH_SECONDS):
+        self.url = url
+        self.refresh_seconds = refresh_seconds
+        self._keys = {}
+        self._last_refresh = None
+        self._refresh_lock = asyncio.Lock()
+        self._task = None
+
+    async def refresh(self):
+        async with self._refresh_lock:
+            await self._fetch()
+
+    async def _fetch(self):
+        # Failed attempts count too, so an outage doesn't turn every unknown kid into a fetch
+        self._last_refresh = time.monotonic()
+        async with httpx.AsyncClient(timeout=5.0) as http:
+            response = await http.get(self.url)
+            response.raise_for_status()
+        keys = {}
+        for jwk in response.json().get("keys", []):
+            try:
+                keys[jwk.get("kid")] = jwt.PyJWK(jwk)
+            except jwt.PyJWKError:
+                logger.warning("Skipping unsupported JWK %s", jwk.get("kid"))
+        self._keys = keys
+
+    def _refresh_due(self):
+        return self._last_refresh is None or time.monotonic() - self._last_refresh > JWKS_MIN_REFRESH_SECONDS
+
+    async def get_key(self, kid):
+        key = self._keys.get(kid)
+        # A refresh already under way may bring this kid, so wait for it
+        if key is not None or not (self._refresh_due() or self._refresh_lock.locked()):
+            return key
+        async with self._refresh_lock:
+            # Whoever held the lock before us may already have refreshed
+            key = self._keys.get(kid)
+            if key is None and self._refresh_due():
+                try:
+                    await self._fetch()
+                except (httpx.HTTPError, ValueError):
+                    logger.warning("JWKS refresh from %s failed", self.url)
+                key = self._keys.get(kid)
+        return key
+
+    async def _refresh_forever(self):
+        while True:
+            try:
+                await self.refresh()
+            except (httpx.HTTPError, ValueError):
+                logger.warning("JWKS refresh from %s failed", self.url)
+            await asyncio.sleep(self.refresh_seconds)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class TokenVerifier:
+    """Checks Supabase access tokens locally with the project secret or JWKS.
+
+    Raises `jwt.InvalidTokenError` for tokens that are definitely bad and
+    `LocalVerificationUnavailable` when no local key applies.
+    """
+
+    def __init__(self, secret=None, jwks=None, audience=JWT_AUDIENCE):
+        self.secret = secret
+        self.jwks = jwks
+        self.audience = audience
+
+    async def verify(self, token):
+        header = jwt.get_unverified_header(token)
+        algorithm = header.get("alg")
+
+        if algorithm == "HS256":
+            if not self.secret:
+                raise LocalVerificationUnavailable(algorithm)
+            key = self.secret
+        elif algorithm in ASYMMETRIC_ALGORITHMS:
+            if self.jwks is None:
+                raise LocalVerificationUnavailable(algorithm)
+            jwk = await self.jwks.get_key(header.get("kid"))
+            if jwk is None:
+                raise LocalVerificationUnavailable(algorithm)
+            key = jwk.key
+        else:
+            raise jwt.InvalidAlgorithmError(algorithm)
+
+        return jwt.decode(
+            token,
+            key,
+            algorithms=[algorithm],
+            audience=self.audience,
+            options={"require": ["exp", "sub"]},
+        )
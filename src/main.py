@@ -1,14 +1,37 @@
 import uvicorn
-from fastapi import FastAPI, Depends, Request
-from fastapi.responses import StreamingResponse, RedirectResponse
+from contextlib import asynccontextmanager
+import asyncio
+import time
+from fastapi import FastAPI, Depends, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse, RedirectResponse
 from fastapi.middleware.cors import CORSMiddleware
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
+from starlette.background import BackgroundTask
 
 # These imports assume you have your folder structure set up
-from src.auth.dependencies import get_current_user
-from src.messages.streaming import stream_generator
+from src.auth.dependencies import jwks, AUTH_VERIFY_MODE
+from src.messages.streaming import flush_turns, open_reply, stream_generator, stream_stats
+from src.messages.cache import response_cache
+from src.messages.persistence import writer
+from src.messages.history import context_window, history_cache
+from src.messages.schemas import MessageCreate, MessagePage
+from src.messages.dependencies import get_conversation
+from src.messages.pagination import decode_cursor, encode_cursor
+from src.messages.store import store
+from src.messages.scheduler import SchedulerOverloaded, http_client, priority_for, scheduler
+from src.ratelimit.dependencies import charge_prompt_tokens, rate_limit
+from src.metrics import phase_metrics, timings_for
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Keep Supabase signing keys warm so token checks never wait on the network
+    if AUTH_VERIFY_MODE == "local":
+        jwks.start()
+    writer.start()
+    yield
+    await flush_turns()
+    await writer.stop()
+    await jwks.stop()
+    await http_client.aclose()
 
 # 1. Initialize FastAPI with Redoc metadata
 app = FastAPI(
@@ -16,15 +39,11 @@ app = FastAPI(
     version="1.0.0",
     description="Secure REST API with SSE Streaming and Supabase Auth",
     docs_url="/docs",   # Swagger UI
-    redoc_url="/redoc"  # ReDoc UI
+    redoc_url="/redoc",  # ReDoc UI
+    lifespan=lifespan,
 )
 
-# 2. Initialize Rate Limiter
-limiter = Limiter(key_func=get_remote_address)
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
-
-# 3. Add CORS Middleware (Essential for API accessibility)
+# 2. Add CORS Middleware (Essential for API accessibility)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -33,7 +52,7 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 4. Root Redirect: This allows you to open http://127.0.0.1:8000 
+# 3. Root Redirect: This allows you to open http://127.0.0.1:8000 
 # and go directly to the ReDoc link you requested.
 @app.get("/", include_in_schema=False)
 async def root_to_docs():
@@ -44,22 +63,85 @@ async def root_to_docs():
 def health_check():
     return {"status": "online", "docs": "/redoc"}
 
+@app.get("/health/upstream", tags=["System"])
+def upstream_health():
+    """Scheduler queue depth, per-model concurrency, queue wait times, stream outcomes and cache use."""
+    return {**scheduler.stats(), "streams": stream_stats, "response_cache": response_cache.stats()}
+
+@app.get("/metrics", tags=["System"], response_class=PlainTextResponse)
+def metrics():
+    """Per-phase latency histograms and service gauges in Prometheus text format."""
+    upstream = scheduler.stats()
+    gauges = {
+        "upstream_queue_depth": upstream["queued"],
+        "upstream_queue_wait_ms_avg": upstream["queue_wait_ms"]["avg"],
+        "upstream_rejected_total": upstream["rejected"] + upstream["timed_out"],
+        "upstream_retries_total": upstream["retries"],
+        "persistence_queue_depth": writer.depth(),
+        "persistence_dropped_total": writer.stats["dropped"],
+        "persistence_failed_total": writer.stats["failed"],
+        "response_cache_hits_total": response_cache.counters["hits"],
+        "response_cache_joined_total": response_cache.counters["joined"],
+    }
+    for outcome, count in stream_stats.items():
+        gauges[f'chat_streams_total{{outcome="{outcome}"}}'] = count
+    return phase_metrics.render(gauges)
+
 @app.post(
     "/api/v1/conversations/{id}/messages/stream", 
     tags=["Messages"],
     summary="Stream AI Chat Response"
 )
-@limiter.limit("10/minute")
-async def chat_stream(id: str, request: Request, user=Depends(get_current_user)):
-    # In your full implementation, you would fetch history from Supabase here
-    dummy_messages = [{"role": "user", "content": "Hello!"}]
-    
+async def chat_stream(
+    id: str,
+    body: MessageCreate,
+    request: Request,
+    user=Depends(rate_limit),
+    conversation=Depends(get_conversation),
+):
+    model = conversation["model"] or "llama3-8b-8192"
+    started = time.perf_counter()
+    history = await history_cache.load(id)
+    timings_for(request).record("history_load", time.perf_counter() - started)
+    messages, prompt_tokens = history.context(model, body.content, conversation["system_prompt"])
+    if prompt_tokens > context_window(model):
+        # The provider would only reject it after the stream has started
+        raise HTTPException(status_code=413, detail="Message is too long for this model's context window")
+    await charge_prompt_tokens(user.id, prompt_tokens)
+
+    # Any wait for an upstream slot happens before committing to a 200, so overload is a fast 503
+    try:
+        reply = await open_reply(messages, model, priority=priority_for(user))
+    except SchedulerOverloaded as exc:
+        raise HTTPException(status_code=503, detail=str(exc), headers={"Retry-After": "1"})
+
     return StreamingResponse(
-        stream_generator(dummy_messages, "llama3-8b-8192", id),
-        media_type="text/event-stream"
+        stream_generator(request, reply, messages, model, id, user.id),
+        media_type="text/event-stream",
+        # Lets go of the upstream even if the client leaves before the body is iterated
+        background=BackgroundTask(reply.detach),
     )
 
-# 5. Entry Point
+@app.get(
+    "/api/v1/conversations/{id}/messages",
+    tags=["Messages"],
+    summary="List Conversation Messages",
+    response_model=MessagePage,
+)
+async def list_messages(
+    id: str,
+    cursor: str | None = None,
+    limit: int = Query(50, ge=1, le=200),
+    conversation=Depends(get_conversation),
+):
+    """Newest messages first; pass `next_cursor` back as `cursor` for older ones."""
+    before = decode_cursor(cursor) if cursor else None
+    # Keyset on (created_at, id): every page is an index range scan, however deep
+    rows = await asyncio.to_thread(store.fetch_messages_before, id, before, limit + 1)
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return {"messages": rows[:limit], "next_cursor": next_cursor}
+
+# 4. Entry Point
 if __name__ == "__main__":
     # Runs on 127.0.0.1 (Localhost). 
     # Open http://127.0.0.1:8000 in your browser to see ReDoc.
@@ -0,0 +1,98 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+from src.messages.sse import dumps
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "0").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_BYTES = int(os.getenv("RESPONSE_CACHE_BYTES", str(16 * 1024 * 1024)))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+
+
+def _normalize(messages):
+    return [
+        {"role": message["role"].lower(), "content": message["content"].replace("\r\n", "\n").strip()}
+        for message in messages
+    ]
+
+
+class ResponseCache:
+    """Exact-match reply cache plus the registry of generations still in flight.
+
+    Opt-in because sampling makes replies nondeterministic: a hit returns the
+    same text for what would otherwise be a fresh sample. Entries are evicted
+    LRU once their total size passes `max_bytes`, and expire after `ttl`.
+    """
+
+    def __init__(self, enabled=RESPONSE_CACHE_ENABLED, max_bytes=RESPONSE_CACHE_BYTES, ttl=RESPONSE_CACHE_TTL):
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self.counters = {"hits": 0, "joined": 0, "misses": 0, "stored": 0}
+
+    @staticmethod
+    def key(model, messages, params):
+        payload = dumps({"model": model, "messages": _normalize(messages), "params": params})
+        return hashlib.sha256(payload).hexdigest()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        deltas, size, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.bytes -= size
+            return None
+        self._entries.move_to_end(key)
+        self.counters["hits"] += 1
+        return deltas
+
+    def put(self, key, deltas):
+        size = sum(len(delta.encode()) for delta in deltas)
+        if size > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.bytes -= previous[1]
+        self._entries[key] = (tuple(deltas), size, time.monotonic() + self.ttl)
+        self.bytes += size
+        self.counters["stored"] += 1
+        while self.bytes > self.max_bytes:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self.bytes -= evicted_size
+
+    def inflight(self, key):
+        generation = self._inflight.get(key)
+        if generation is None or generation.cancelling:
+            # A generation being cancelled still finishes on a later tick
+            return None
+        self.counters["joined"] += 1
+        return generation
+
+    def track(self, key, generation):
+        self.counters["misses"] += 1
+        self._inflight[key] = generation
+
+    def finish(self, key, generation, deltas=None):
+        """Drop a finished generation from the registry, caching it if it completed."""
+        if self._inflight.get(key) is generation:
+            del self._inflight[key]
+        if deltas is not None:
+            self.put(key, deltas)
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "inflight": len(self._inflight),
+            **self.counters,
+        }
+
+
+response_cache = ResponseCache()
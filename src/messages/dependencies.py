@@ -0,0 +1,46 @@
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+
+from fastapi import Depends, HTTPException
+
+from src.auth.dependencies import get_current_user
+from src.messages.store import store
+
+CONVERSATION_CACHE_SIZE = int(os.getenv("CONVERSATION_CACHE_SIZE", "10000"))
+CONVERSATION_CACHE_TTL = float(os.getenv("CONVERSATION_CACHE_TTL", "60"))
+
+# conversation id -> (row, expires_at); ownership never changes, so a short
+# TTL only bounds how stale the model / system prompt can be
+_conversations = OrderedDict()
+
+
+async def _load_conversation(conversation_id):
+    entry = _conversations.get(conversation_id)
+    if entry is not None and entry[1] > time.monotonic():
+        _conversations.move_to_end(conversation_id)
+        return entry[0]
+
+    conversation = await asyncio.to_thread(store.fetch_conversation, conversation_id)
+    if conversation is not None:
+        _conversations[conversation_id] = (conversation, time.monotonic() + CONVERSATION_CACHE_TTL)
+        _conversations.move_to_end(conversation_id)
+        while len(_conversations) > CONVERSATION_CACHE_SIZE:
+            _conversations.popitem(last=False)
+    return conversation
+
+
+async def get_conversation(id: str, user=Depends(get_current_user)):
+    """The conversation in the path, provided it belongs to the caller."""
+    try:
+        # PostgREST rejects a malformed uuid with an error rather than an empty result
+        uuid.UUID(id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    conversation = await _load_conversation(id)
+    # Reads run with the service key, so ownership is enforced here rather than by RLS
+    if conversation is None or str(conversation["user_id"]) != str(user.id):
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return conversation
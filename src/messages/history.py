@@ -0,0 +1,177 @@
+import asyncio
+import os
+from collections import OrderedDict
+
+from src.messages.store import store
+from src.messages.tokens import count_tokens
+
+MODEL_CONTEXT_WINDOWS = {
+    "llama3-8b-8192": 8192,
+    "llama3-70b-8192": 8192,
+    "llama-3.1-8b-instant": 131072,
+    "llama-3.3-70b-versatile": 131072,
+    "mixtral-8x7b-32768": 32768,
+    "gemma2-9b-it": 8192,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+HISTORY_CACHE_BYTES = int(os.getenv("HISTORY_CACHE_BYTES", str(64 * 1024 * 1024)))
+# Nothing older than the largest context window is ever sent upstream, so a
+# conversation's cached tail is capped at this many tokens. Lowering it saves
+# memory but shortens the history long-context models get to see.
+HISTORY_MAX_CACHED_TOKENS = int(os.getenv("HISTORY_MAX_CACHED_TOKENS", str(max(MODEL_CONTEXT_WINDOWS.values()))))
+HISTORY_INITIAL_LIMIT = int(os.getenv("HISTORY_INITIAL_LIMIT", "500"))
+RESPONSE_TOKEN_RESERVE = int(os.getenv("RESPONSE_TOKEN_RESERVE", "1024"))
+# Role markers and separators the chat template adds around each message
+MESSAGE_TOKEN_OVERHEAD = 4
+
+
+def context_window(model):
+    """Prompt tokens a model accepts once the reply's reserve is set aside."""
+    return MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW) - RESPONSE_TOKEN_RESERVE
+
+
+def _prepare(row):
+    if row.get("token_count") is None:
+        row["token_count"] = count_tokens(row["content"])
+    return row
+
+
+def _row_bytes(row):
+    return len(row["content"].encode())
+
+
+def _row_key(row):
+    return row["created_at"], row["id"]
+
+
+class ConversationHistory:
+    """Cached tail of one conversation with running token and byte totals."""
+
+    def __init__(self):
+        self.messages = []
+        self.ids = set()
+        self.tokens = 0
+        self.bytes = 0
+        # Newest row read from the store. Rows appended locally don't move it:
+        # another worker's turn can land later with an older created_at.
+        self.fetched = None
+        # Newest row trimmed away; anything at or before it is not re-added
+        self._floor = None
+
+    def extend(self, rows, fetched=False):
+        unordered = False
+        for row in rows:
+            key = _row_key(row)
+            if fetched and (self.fetched is None or key > self.fetched):
+                self.fetched = key
+            if row["id"] in self.ids or (self._floor is not None and key <= self._floor):
+                continue
+            if self.messages and key < _row_key(self.messages[-1]):
+                unordered = True
+            self.messages.append(row)
+            self.ids.add(row["id"])
+            self.tokens += row["token_count"] + MESSAGE_TOKEN_OVERHEAD
+            self.bytes += _row_bytes(row)
+        if unordered:
+            self.messages.sort(key=_row_key)
+        self._trim(HISTORY_MAX_CACHED_TOKENS)
+
+    def _trim(self, max_tokens):
+        drop = 0
+        while self.tokens > max_tokens and drop < len(self.messages) - 1:
+            row = self.messages[drop]
+            self.ids.discard(row["id"])
+            self.tokens -= row["token_count"] + MESSAGE_TOKEN_OVERHEAD
+            self.bytes -= _row_bytes(row)
+            drop += 1
+        if drop:
+            self._floor = _row_key(self.messages[drop - 1])
+            del self.messages[:drop]
+
+    def context(self, model, new_message, system_prompt=None):
+        """Newest messages that fit the model's window, and their token total.
+
+        The new message and system prompt are always included, so the total
+        can exceed `context_window(model)`; callers must check it.
+        """
+        window = context_window(model)
+        fixed = count_tokens(new_message) + MESSAGE_TOKEN_OVERHEAD
+        if system_prompt:
+            fixed += count_tokens(system_prompt) + MESSAGE_TOKEN_OVERHEAD
+        budget = window - fixed
+
+        start = len(self.messages)
+        if self.tokens <= budget:
+            start, used = 0, self.tokens
+        else:
+            used = 0
+            while start > 0:
+                cost = self.messages[start - 1]["token_count"] + MESSAGE_TOKEN_OVERHEAD
+                if used + cost > budget:
+                    break
+                used += cost
+                start -= 1
+
+        messages = [{"role": "system", "content": system_prompt}] if system_prompt else []
+        messages.extend({"role": row["role"], "content": row["content"]} for row in self.messages[start:])
+        messages.append({"role": "user", "content": new_message})
+        return messages, used + fixed
+
+
+class HistoryCache:
+    """Per-conversation history, fetched incrementally and LRU-evicted by bytes.
+
+    Each turn only asks the store for rows newer than the last one it
+    returned, so per-turn cost grows with the new messages instead of the
+    conversation length. Rows this process writes are appended directly so
+    the next turn sees them at once; they come back in a later fetch and
+    are deduplicated by id.
+    """
+
+    def __init__(self, store, max_bytes=HISTORY_CACHE_BYTES):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()
+
+    def _fetch(self, conversation_id, cursor):
+        if cursor is None:
+            rows = self.store.fetch_latest_messages(conversation_id, HISTORY_INITIAL_LIMIT)
+        else:
+            rows = self.store.fetch_messages_after(conversation_id, cursor)
+        return [_prepare(row) for row in rows]
+
+    async def load(self, conversation_id):
+        history = self._entries.get(conversation_id)
+        cursor = history.fetched if history is not None else None
+        rows = await asyncio.to_thread(self._fetch, conversation_id, cursor)
+
+        # Another request may have loaded or evicted the entry while we waited
+        history = self._entries.get(conversation_id)
+        if history is None:
+            if cursor is not None:
+                # Evicted: the rows above are only the increment, so load the transcript afresh
+                rows = await asyncio.to_thread(self._fetch, conversation_id, None)
+            history = self._entries.get(conversation_id) or ConversationHistory()
+        self._update(conversation_id, history, rows, fetched=True)
+        return history
+
+    def append(self, conversation_id, rows):
+        """Record rows written by this process so the next load needn't fetch them."""
+        history = self._entries.get(conversation_id)
+        if history is not None:
+            self._update(conversation_id, history, [_prepare(row) for row in rows])
+
+    def _update(self, conversation_id, history, rows, fetched=False):
+        before = history.bytes if conversation_id in self._entries else 0
+        history.extend(rows, fetched)
+        self._entries[conversation_id] = history
+        self._entries.move_to_end(conversation_id)
+        self.bytes += history.bytes - before
+        while self.bytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= evicted.bytes
+
+
+history_cache = HistoryCache(store)
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import os
+import time
+
+from src.messages.store import store
+from src.messages.tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+PERSIST_QUEUE_SIZE = int(os.getenv("PERSIST_QUEUE_SIZE", "10000"))
+PERSIST_BATCH_SIZE = int(os.getenv("PERSIST_BATCH_SIZE", "200"))
+PERSIST_FLUSH_MS = float(os.getenv("PERSIST_FLUSH_MS", "50"))
+PERSIST_MAX_RETRIES = int(os.getenv("PERSIST_MAX_RETRIES", "5"))
+
+
+class MessageWriter:
+    """Write-behind queue for message rows.
+
+    Streams hand finished turns to `enqueue` and move on; a single worker
+    drains the queue and writes each batch with one multi-row insert, so
+    database round trips scale with batches rather than messages.
+    """
+
+    def __init__(
+        self,
+        store,
+        max_queue=PERSIST_QUEUE_SIZE,
+        batch_size=PERSIST_BATCH_SIZE,
+        flush_ms=PERSIST_FLUSH_MS,
+        max_retries=PERSIST_MAX_RETRIES,
+    ):
+        self.store = store
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self.max_retries = max_retries
+        self.max_queue = max_queue
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._task = None
+        self.stats = {"enqueued": 0, "written": 0, "dropped": 0, "failed": 0, "batches": 0}
+
+    def enqueue(self, *rows):
+        """Queue rows that must be written together; never waits on the database."""
+        try:
+            self._queue.put_nowait(list(rows))
+        except asyncio.QueueFull:
+            self.stats["dropped"] += len(rows)
+            logger.error("Persistence queue full, dropping %d message rows", len(rows))
+            return False
+        self.stats["enqueued"] += len(rows)
+        return True
+
+    def depth(self):
+        return self._queue.qsize()
+
+    async def _next_batch(self):
+        items = [await self._queue.get()]
+        size = len(items[0])
+        deadline = time.monotonic() + self.flush_interval
+        while size < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            items.append(item)
+            size += len(item)
+        return items
+
+    def _write(self, rows):
+        try:
+            for row in rows:
+                if row.get("token_count") is None:
+                    row["token_count"] = count_tokens(row["content"])
+        except Exception:
+            # A missing tokenizer must not cost us the messages themselves
+            logger.exception("Could not count tokens; storing rows without token_count")
+        self.store.insert_messages(rows)
+
+    async def _write_with_retries(self, items):
+        rows = [row for item in items for row in item]
+        for attempt in range(self.max_retries + 1):
+            try:
+                await asyncio.to_thread(self._write, rows)
+                self.stats["written"] += len(rows)
+                self.stats["batches"] += 1
+                return
+            except Exception:
+                if attempt == self.max_retries:
+                    break
+                await asyncio.sleep(min(0.1 * 2 ** attempt, 5.0))
+        # Still failing: a single bad turn may be rejecting the whole insert
+        logger.exception("Batch of %d message rows failed; retrying turn by turn", len(rows))
+        await self._bisect(items)
+
+    async def _bisect(self, items):
+        """Write `items` in halves until only the turns that fail on their own are left."""
+        rows = [row for item in items for row in item]
+        try:
+            await asyncio.to_thread(self._write, rows)
+        except Exception:
+            if len(items) == 1:
+                self.stats["failed"] += len(rows)
+                logger.exception("Giving up on %d message rows", len(rows))
+                return
+            middle = len(items) // 2
+            await self._bisect(items[:middle])
+            await self._bisect(items[middle:])
+            return
+        self.stats["written"] += len(rows)
+        self.stats["batches"] += 1
+
+    async def _run(self):
+        while True:
+            items = await self._next_batch()
+            try:
+                await self._write_with_retries(items)
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+
+    def start(self):
+        if self._task is None:
+            # Queues bind to the loop that first waits on them
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout=10.0):
+        """Flush what is queued (up to `timeout` seconds) and stop the worker."""
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.error("Shutting down with %d unwritten message batches", self._queue.qsize())
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+writer = MessageWriter(store)
@@ -0,0 +1,238 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import re
+import time
+from collections import deque
+
+import groq
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "200"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "50"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "60"))
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "3"))
+# Never sleep longer than this for a single retry, whatever the provider asks for
+UPSTREAM_MAX_BACKOFF = float(os.getenv("UPSTREAM_MAX_BACKOFF", "10"))
+
+MODEL_CONCURRENCY = int(os.getenv("MODEL_CONCURRENCY", "32"))
+# e.g. "llama3-70b-8192=8,llama3-8b-8192=64"
+MODEL_CONCURRENCY_LIMITS = {
+    name.strip(): int(limit)
+    for name, _, limit in (
+        item.partition("=") for item in os.getenv("MODEL_CONCURRENCY_LIMITS", "").split(",") if item.strip()
+    )
+}
+# Queue priority by the plan in a user's app_metadata, e.g. "pro=10,team=20"; others get 0
+SCHEDULER_PLAN_PRIORITIES = {
+    name.strip(): int(priority)
+    for name, _, priority in (
+        item.partition("=") for item in os.getenv("SCHEDULER_PLAN_PRIORITIES", "").split(",") if item.strip()
+    )
+}
+SCHEDULER_MAX_QUEUE = int(os.getenv("SCHEDULER_MAX_QUEUE", "256"))
+SCHEDULER_QUEUE_TIMEOUT = float(os.getenv("SCHEDULER_QUEUE_TIMEOUT_MS", "5000")) / 1000
+
+RETRYABLE_ERRORS = (groq.RateLimitError, groq.InternalServerError, groq.APIConnectionError)
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+# One tuned pool shared by every upstream call: streams multiplex over a few
+# long-lived HTTP/2 connections instead of opening a socket per request.
+http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(
+        max_connections=UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+        keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+    ),
+    timeout=httpx.Timeout(connect=5.0, read=60.0, write=10.0, pool=5.0),
+)
+
+
+def priority_for(user):
+    """Queue priority for a user's requests; app_metadata is only writable server-side."""
+    plan = (getattr(user, "app_metadata", None) or {}).get("plan")
+    return SCHEDULER_PLAN_PRIORITIES.get(plan, 0)
+
+
+class SchedulerOverloaded(Exception):
+    """No upstream slot is available within the queueing budget."""
+
+
+class Slot:
+    """A granted upstream slot; `release` is idempotent."""
+
+    def __init__(self, scheduler, lane, wait_ms):
+        self._scheduler = scheduler
+        self._lane = lane
+        self.wait_ms = wait_ms
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self._scheduler._release(self._lane)
+
+
+class _Lane:
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self.queued = 0
+        self.waiters = []
+
+
+class UpstreamScheduler:
+    """Per-model concurrency limits in front of the provider.
+
+    Requests beyond a model's limit wait in a bounded priority queue (higher
+    `priority` first, FIFO within a priority). A full queue or an expired
+    queue-time deadline raises `SchedulerOverloaded`, which the API turns
+    into an immediate 503.
+    """
+
+    def __init__(self, default_limit=MODEL_CONCURRENCY, limits=None, max_queue=SCHEDULER_MAX_QUEUE):
+        self.default_limit = default_limit
+        self.limits = limits or {}
+        self.max_queue = max_queue
+        self.queued = 0
+        self._lanes = {}
+        self._seq = itertools.count()
+        self._waits = deque(maxlen=1000)
+        self.counters = {"granted": 0, "rejected": 0, "timed_out": 0, "retries": 0}
+
+    def _lane(self, model):
+        lane = self._lanes.get(model)
+        if lane is None:
+            lane = self._lanes[model] = _Lane(self.limits.get(model, self.default_limit))
+        return lane
+
+    def _grant(self, lane, started):
+        wait_ms = (time.monotonic() - started) * 1000
+        self._waits.append(wait_ms)
+        self.counters["granted"] += 1
+        return Slot(self, lane, wait_ms)
+
+    async def acquire(self, model, priority=0, timeout=SCHEDULER_QUEUE_TIMEOUT):
+        lane = self._lane(model)
+        started = time.monotonic()
+        if lane.active < lane.limit and lane.queued == 0:
+            lane.active += 1
+            return self._grant(lane, started)
+
+        if self.queued >= self.max_queue:
+            self.counters["rejected"] += 1
+            raise SchedulerOverloaded("Upstream queue is full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(lane.waiters, (-priority, next(self._seq), waiter))
+        self.queued += 1
+        lane.queued += 1
+        try:
+            done, _ = await asyncio.wait((waiter,), timeout=timeout)
+        except asyncio.CancelledError:
+            # A slot may have been handed over just before we were cancelled
+            if waiter.done() and not waiter.cancelled():
+                self._release(lane)
+            else:
+                waiter.cancel()
+            raise
+        finally:
+            self.queued -= 1
+            lane.queued -= 1
+
+        if not done:
+            waiter.cancel()
+            self.counters["timed_out"] += 1
+            if len(lane.waiters) > 2 * self.max_queue:
+                lane.waiters = [entry for entry in lane.waiters if not entry[2].done()]
+                heapq.heapify(lane.waiters)
+            raise SchedulerOverloaded("Timed out waiting for an upstream slot")
+        return self._grant(lane, started)
+
+    def _release(self, lane):
+        lane.active -= 1
+        while lane.waiters and lane.active < lane.limit:
+            _, _, waiter = heapq.heappop(lane.waiters)
+            if waiter.done():
+                continue
+            waiter.set_result(None)
+            lane.active += 1
+
+    def stats(self):
+        waits = list(self._waits)
+        return {
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "queue_wait_ms": {
+                "avg": round(sum(waits) / len(waits), 2) if waits else 0.0,
+                "max": round(max(waits), 2) if waits else 0.0,
+            },
+            "models": {
+                model: {"active": lane.active, "limit": lane.limit, "queued": lane.queued}
+                for model, lane in self._lanes.items()
+            },
+            **self.counters,
+        }
+
+
+def _parse_duration(value):
+    """Seconds from Groq's reset headers ("7.66s", "2m59.56s", "120ms") or a plain number."""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def _header_duration(headers, name):
+    value = headers.get(name)
+    return _parse_duration(value) if value else None
+
+
+def _retry_delay(error, attempt):
+    response = getattr(error, "response", None)
+    if response is not None:
+        # retry-after is authoritative
+        delay = _header_duration(response.headers, "retry-after")
+        if delay is not None:
+            return delay
+        resets, exhausted = [], []
+        for limit in ("requests", "tokens"):
+            reset = _header_duration(response.headers, f"x-ratelimit-reset-{limit}")
+            if reset is None:
+                continue
+            resets.append(reset)
+            if response.headers.get(f"x-ratelimit-remaining-{limit}") == "0":
+                exhausted.append(reset)
+        # Wait for the limit that was hit; if that's unclear, for every limit to reset
+        if exhausted or resets:
+            return max(exhausted or resets)
+    return min(0.25 * 2 ** attempt, UPSTREAM_MAX_BACKOFF)
+
+
+async def create_stream(client, **kwargs):
+    """Open a streaming completion, retrying rate limits and transient failures."""
+    for attempt in range(UPSTREAM_MAX_RETRIES + 1):
+        try:
+            return await client.chat.completions.create(stream=True, **kwargs)
+        except RETRYABLE_ERRORS as error:
+            delay = _retry_delay(error, attempt)
+            if attempt == UPSTREAM_MAX_RETRIES or delay > UPSTREAM_MAX_BACKOFF:
+                raise
+            scheduler.counters["retries"] += 1
+            logger.warning("Upstream %s, retrying in %.2fs", type(error).__name__, delay)
+            await asyncio.sleep(delay)
+
+
+scheduler = UpstreamScheduler(limits=MODEL_CONCURRENCY_LIMITS)
@@ -0,0 +1,30 @@
+from typing import List, Optional
+
+from pydantic import BaseModel, Field, field_validator
+
+
+class MessageCreate(BaseModel):
+    content: str = Field(..., min_length=1)
+
+    @field_validator("content")
+    @classmethod
+    def reject_nul(cls, value):
+        # Postgres text columns cannot store NUL, so the insert would fail later
+        if "\x00" in value:
+            raise ValueError("content must not contain NUL characters")
+        return value
+
+
+class MessageOut(BaseModel):
+    id: str
+    role: str
+    content: str
+    token_count: Optional[int] = None
+    latency_ms: Optional[int] = None
+    is_truncated: bool = False
+    created_at: str
+
+
+class MessagePage(BaseModel):
+    messages: List[MessageOut]
+    next_cursor: Optional[str] = None
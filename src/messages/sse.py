@@ -0,0 +1,38 @@
+import json
+from functools import lru_cache
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is an optional speed-up
+    orjson = None
+
+
+if orjson is not None:
+    def dumps(obj):
+        return orjson.dumps(obj)
+else:
+    def dumps(obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def _frame(event, data):
+    return b"event: " + event.encode() + b"\ndata: " + dumps(data) + b"\n\n"
+
+
+# Frames that never change are encoded once at import time
+CONTENT_BLOCK_START = _frame("content_block_start", {"index": 0})
+CONTENT_BLOCK_STOP = _frame("content_block_stop", {"index": 0})
+MESSAGE_STOP = _frame("message_stop", {})
+
+_DELTA_PREFIX = b'event: content_block_delta\ndata: {"delta":{"text":'
+_DELTA_SUFFIX = b"}}\n\n"
+
+
+@lru_cache(maxsize=64)
+def message_start(model):
+    return _frame("message_start", {"type": "message_start", "message": {"role": "assistant", "model": model}})
+
+
+def content_block_delta(text):
+    # Only the text itself needs escaping; the envelope around it is fixed
+    return _DELTA_PREFIX + dumps(text) + _DELTA_SUFFIX
@@ -0,0 +1,169 @@
+import os
+import sqlite3
+import threading
+
+from dotenv import load_dotenv
+from supabase import create_client
+
+load_dotenv()
+
+MESSAGE_COLUMNS = (
+    "id", "conversation_id", "role", "content", "token_count", "latency_ms", "is_truncated", "created_at",
+)
+CONVERSATION_COLUMNS = ("id", "user_id", "model", "system_prompt")
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    user_id TEXT,
+    title TEXT DEFAULT 'New Conversation',
+    model TEXT NOT NULL,
+    system_prompt TEXT,
+    is_archived INTEGER DEFAULT 0,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    conversation_id TEXT NOT NULL,
+    role TEXT CHECK (role IN ('user', 'assistant', 'system')),
+    content TEXT NOT NULL,
+    token_count INTEGER,
+    latency_ms INTEGER,
+    is_truncated INTEGER DEFAULT 0,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_conversation_created_idx ON messages (conversation_id, created_at, id);
+CREATE INDEX IF NOT EXISTS conversations_user_updated_idx ON conversations (user_id, updated_at DESC);
+"""
+
+
+class SupabaseStore:
+    """Reads and writes the `messages` table through PostgREST."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def insert_messages(self, rows):
+        # One POST with a JSON array becomes a single multi-row INSERT; rows
+        # already written by an earlier attempt are skipped, so retries are safe
+        self.client.table("messages").upsert(rows, ignore_duplicates=True).execute()
+
+    def fetch_messages_after(self, conversation_id, after):
+        """Messages strictly newer than the `(created_at, id)` cursor, oldest first."""
+        created_at, message_id = after
+        response = (
+            self.client.table("messages")
+            .select(", ".join(MESSAGE_COLUMNS))
+            .eq("conversation_id", conversation_id)
+            .or_(f'created_at.gt."{created_at}",and(created_at.eq."{created_at}",id.gt.{message_id})')
+            .order("created_at")
+            .order("id")
+            .execute()
+        )
+        return response.data
+
+    def fetch_latest_messages(self, conversation_id, limit):
+        """The newest `limit` messages, oldest first."""
+        return self.fetch_messages_before(conversation_id, None, limit)[::-1]
+
+    def fetch_messages_before(self, conversation_id, before, limit):
+        """Up to `limit` messages older than the `(created_at, id)` cursor, newest first."""
+        query = (
+            self.client.table("messages")
+            .select(", ".join(MESSAGE_COLUMNS))
+            .eq("conversation_id", conversation_id)
+        )
+        if before is not None:
+            created_at, message_id = before
+            query = query.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{message_id})')
+        response = query.order("created_at", desc=True).order("id", desc=True).limit(limit).execute()
+        return response.data
+
+    def fetch_conversation(self, conversation_id):
+        response = (
+            self.client.table("conversations")
+            .select(", ".join(CONVERSATION_COLUMNS))
+            .eq("id", conversation_id)
+            .limit(1)
+            .execute()
+        )
+        return response.data[0] if response.data else None
+
+
+class SQLiteStore:
+    """Local stand-in for Supabase with the same `messages` layout."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(SQLITE_SCHEMA)
+
+    def insert_messages(self, rows):
+        placeholders = ", ".join("?" for _ in MESSAGE_COLUMNS)
+        values = [tuple(row.get(column) for column in MESSAGE_COLUMNS) for row in rows]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT OR IGNORE INTO messages ({', '.join(MESSAGE_COLUMNS)}) VALUES ({placeholders})",
+                values,
+            )
+
+    def _select(self, sql, params, columns=MESSAGE_COLUMNS):
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def fetch_messages_after(self, conversation_id, after):
+        created_at, message_id = after
+        return self._select(
+            f"SELECT {', '.join(MESSAGE_COLUMNS)} FROM messages "
+            "WHERE conversation_id = ? AND (created_at > ? OR (created_at = ? AND id > ?)) "
+            "ORDER BY created_at, id",
+            (conversation_id, created_at, created_at, message_id),
+        )
+
+    def fetch_latest_messages(self, conversation_id, limit):
+        return self.fetch_messages_before(conversation_id, None, limit)[::-1]
+
+    def fetch_messages_before(self, conversation_id, before, limit):
+        if before is None:
+            return self._select(
+                f"SELECT {', '.join(MESSAGE_COLUMNS)} FROM messages "
+                "WHERE conversation_id = ? ORDER BY created_at DESC, id DESC LIMIT ?",
+                (conversation_id, limit),
+            )
+        created_at, message_id = before
+        return self._select(
+            f"SELECT {', '.join(MESSAGE_COLUMNS)} FROM messages "
+            "WHERE conversation_id = ? AND (created_at < ? OR (created_at = ? AND id < ?)) "
+            "ORDER BY created_at DESC, id DESC LIMIT ?",
+            (conversation_id, created_at, created_at, message_id, limit),
+        )
+
+    def fetch_conversation(self, conversation_id):
+        rows = self._select(
+            f"SELECT {', '.join(CONVERSATION_COLUMNS)} FROM conversations WHERE id = ?",
+            (conversation_id,),
+            CONVERSATION_COLUMNS,
+        )
+        return rows[0] if rows else None
+
+    def close(self):
+        self._conn.close()
+
+
+def create_store():
+    # DATABASE_URL=sqlite:///./database.db selects the local store; anything
+    # else talks to Supabase with the service key: writes happen outside the
+    # user's session, where RLS has no auth.uid() and anon inserts are refused.
+    database_url = os.getenv("DATABASE_URL", "")
+    if database_url.startswith("sqlite:///"):
+        return SQLiteStore(database_url[len("sqlite:///"):])
+    key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+    if not key:
+        raise RuntimeError("SUPABASE_SERVICE_ROLE_KEY is required unless DATABASE_URL points at SQLite")
+    return SupabaseStore(create_client(os.getenv("SUPABASE_URL"), key))
+
+
+store = create_store()
@@ -1,29 +1,318 @@
-import json
+import asyncio
+import time
+import uuid
+from datetime import datetime, timezone
 from groq import AsyncGroq
 import os
 
-client = AsyncGroq(api_key=os.getenv("GROQ_API_KEY"))
+from src.messages.history import history_cache
+from src.messages import sse
+from src.messages.cache import response_cache
+from src.messages.persistence import writer
+from src.messages.scheduler import create_stream, http_client, scheduler
+from src.messages.tokens import count_tokens
+from src.metrics import phase_metrics, timings_for
+from src.ratelimit.dependencies import charge_completion_tokens
+
+# Retries are handled by create_stream so they can honour rate-limit headers
+client = AsyncGroq(api_key=os.getenv("GROQ_API_KEY"), http_client=http_client, max_retries=0)
+
+DISCONNECT_POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_MS", "25")) / 1000
+# Deltas arriving within this window (or until this many UTF-8 bytes) share one event
+SSE_COALESCE_WINDOW = float(os.getenv("SSE_COALESCE_MS", "15")) / 1000
+SSE_COALESCE_BYTES = int(os.getenv("SSE_COALESCE_BYTES", "1024"))
+
+# Markers passed through delta queues alongside text and exceptions
+_DONE = object()
+_DISCONNECTED = object()
+
+stream_stats = {"completed": 0, "cancelled": 0, "failed": 0}
+
+
+class GenerationCancelled(Exception):
+    """Terminal marker for a generation stopped before it finished."""
+
+
+# Finished turns are recorded in background tasks; keep them referenced until done
+_pending_turns = set()
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _message_row(conversation_id, role, content, created_at, latency_ms=None, truncated=False):
+    return {
+        "id": str(uuid.uuid4()),
+        "conversation_id": conversation_id,
+        "role": role,
+        "content": content,
+        "token_count": None,  # counted off the event loop by _record_turn
+        "latency_ms": latency_ms,
+        "is_truncated": truncated,
+        "created_at": created_at,
+    }
+
+
+def _count_rows(rows):
+    return [count_tokens(row["content"]) for row in rows]
+
+
+async def _record_turn(conversation_id, user_id, rows, completion):
+    """Count tokens off the event loop, then persist, cache and charge the turn."""
+    try:
+        for row, tokens in zip(rows, await asyncio.to_thread(_count_rows, rows)):
+            row["token_count"] = tokens
+    finally:
+        # The writer fills in any counts still missing
+        writer.enqueue(*rows)
+    history_cache.append(conversation_id, rows)
+    if completion is not None:
+        charge_completion_tokens(user_id, completion["token_count"])
+
+
+async def flush_turns():
+    """Wait for turns still being recorded, so shutdown doesn't lose them."""
+    if _pending_turns:
+        await asyncio.gather(*_pending_turns, return_exceptions=True)
+
+
+async def _pump(stream, publish):
+    """Hand upstream deltas to `publish`, then a terminal marker; closes the stream on the way out."""
+    try:
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content
+            if delta:
+                publish(delta)
+        publish(_DONE)
+    except Exception as exc:
+        publish(exc)
+    finally:
+        await stream.close()
+
+
+class Generation:
+    """One upstream completion, fanned out to every request subscribed to it.
+
+    It runs in its own task and owns the scheduler slot, so a reader that
+    leaves early doesn't cut off the others; when the last one leaves the
+    upstream stream is cancelled.
+    """
+
+    def __init__(self, key=None):
+        self.key = key
+        self.deltas = []
+        self.terminal = None
+        self.cancelling = False
+        self._subscribers = set()
+        self._task = None
+
+    def start(self, messages, model, slot, params):
+        self._task = asyncio.create_task(self._run(messages, model, slot, params))
+
+    async def _run(self, messages, model, slot, params):
+        try:
+            stream = await create_stream(client, messages=messages, model=model, **params)
+            await _pump(stream, self.publish)
+        except Exception as exc:
+            self.publish(exc)
+        finally:
+            # Cancellation skips the handlers above; anyone still subscribed must not wait forever
+            if self.terminal is None:
+                self.publish(GenerationCancelled("Generation was cancelled"))
+            slot.release()
+            if self.key is not None:
+                response_cache.finish(self.key, self, self.deltas if self.terminal is _DONE else None)
+
+    def publish(self, item):
+        if isinstance(item, str):
+            self.deltas.append(item)
+        else:
+            self.terminal = item
+        for queue in self._subscribers:
+            queue.put_nowait(item)
+
+    def subscribe(self):
+        # Late joiners catch up from the start of the reply
+        queue = asyncio.Queue()
+        for delta in self.deltas:
+            queue.put_nowait(delta)
+        if self.terminal is not None:
+            queue.put_nowait(self.terminal)
+        else:
+            self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self._subscribers.discard(queue)
+        if not self._subscribers and self.terminal is None and self._task is not None:
+            # Stop paying for tokens nobody will read; new requests start afresh
+            self.cancelling = True
+            self._task.cancel()
+
+
+class Reply:
+    """A request's view of a reply: its own delta queue and a way to let go of it."""
+
+    def __init__(self, queue, generation=None, queue_wait=0.0):
+        self.queue = queue
+        self.queue_wait = queue_wait
+        self._generation = generation
+
+    @classmethod
+    def replay(cls, deltas):
+        queue = asyncio.Queue()
+        for delta in deltas:
+            queue.put_nowait(delta)
+        queue.put_nowait(_DONE)
+        return cls(queue)
+
+    def detach(self):
+        if self._generation is not None:
+            self._generation.unsubscribe(self.queue)
+
+
+async def open_reply(messages, model, priority=0, **params):
+    """Subscribe to the reply for this prompt: cached, already in flight, or new.
+
+    Only a new generation waits for a scheduler slot (queued by `priority`),
+    so this raises `SchedulerOverloaded` before any response has been started.
+    """
+    key = response_cache.key(model, messages, params) if response_cache.enabled else None
+    if key is not None:
+        cached = response_cache.get(key)
+        if cached is not None:
+            return Reply.replay(cached)
+
+    queue_wait = 0.0
+    generation = response_cache.inflight(key) if key is not None else None
+    if generation is None:
+        slot = await scheduler.acquire(model, priority)
+        queue_wait = slot.wait_ms / 1000
+        # An identical request may have started while we queued
+        generation = response_cache.inflight(key) if key is not None else None
+        if generation is not None:
+            slot.release()
+        else:
+            generation = Generation(key)
+            if key is not None:
+                response_cache.track(key, generation)
+            generation.start(messages, model, slot, params)
+    return Reply(generation.subscribe(), generation, queue_wait)
+
+
+async def _watch_disconnect(request, reply):
+    while not await request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+    # Let go of the upstream right away, even if the generator is parked
+    reply.detach()
+    reply.queue.put_nowait(_DISCONNECTED)
+
+
+async def _coalesce(queue, window=SSE_COALESCE_WINDOW, max_bytes=SSE_COALESCE_BYTES):
+    """Merge queued deltas into larger chunks, ending with the terminal marker.
+
+    The first delta goes out alone so time-to-first-token is unaffected;
+    later ones are merged until the window closes or `max_bytes` is reached.
+    """
+    loop = asyncio.get_running_loop()
+    first = True
+    while True:
+        item = await queue.get()
+        if not isinstance(item, str):
+            yield item
+            return
+
+        parts = [item]
+        size = len(item.encode())
+        terminal = None
+        if not first:
+            deadline = loop.time() + window
+            while size < max_bytes:
+                try:
+                    item = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                if not isinstance(item, str):
+                    terminal = item
+                    break
+                parts.append(item)
+                size += len(item.encode())
+        first = False
+
+        yield "".join(parts)
+        if terminal is not None:
+            yield terminal
+            return
+
+
+async def stream_generator(request, reply, messages, model, conversation_id, user_id):
+    """SSE events for one reply, from `open_reply`."""
+    timings = timings_for(request)
+    timings.record("queue_wait", reply.queue_wait)
+    first_delta_at = None
+    user_created_at = _now()
 
-async def stream_generator(messages, model, conversation_id):
     # 1. Start Message
-    yield f"event: message_start\ndata: {json.dumps({'type': 'message_start', 'message': {'role': 'assistant', 'model': model}})}\n\n"
-    
-    full_response = ""
-    stream = await client.chat.completions.create(
-        messages=messages,
-        model=model,
-        stream=True
-    )
-
-    yield f"event: content_block_start\ndata: {json.dumps({'index': 0})}\n\n"
-
-    async for chunk in stream:
-        delta = chunk.choices[0].delta.content or ""
-        if delta:
-            full_response += delta
-            yield f"event: content_block_delta\ndata: {json.dumps({'delta': {'text': delta}})}\n\n"
-
-    yield f"event: content_block_stop\ndata: {json.dumps({'index': 0})}\n\n"
-    yield f"event: message_stop\ndata: {json.dumps({})}\n\n"
-    
-    # 📝 TODO: Insert full_response into Supabase messages table here
\ No newline at end of file
+    yield sse.message_start(model) + sse.CONTENT_BLOCK_START
+
+    parts = []
+    outcome = "cancelled"
+    recording = None
+    watcher = asyncio.create_task(_watch_disconnect(request, reply))
+
+    try:
+        async for delta in _coalesce(reply.queue):
+            if delta is _DONE:
+                outcome = "completed"
+                break
+            if delta is _DISCONNECTED:
+                break
+            if isinstance(delta, Exception):
+                outcome = "failed"
+                raise delta
+            if first_delta_at is None:
+                first_delta_at = time.perf_counter()
+                timings.record("ttft", timings.since_start())
+            parts.append(delta)
+            yield sse.content_block_delta(delta)
+    finally:
+        # Also reached when the server closes us after a failed send
+        watcher.cancel()
+        reply.detach()
+        stream_stats[outcome] += 1
+        if first_delta_at is not None:
+            timings.record("stream", time.perf_counter() - first_delta_at)
+        timings.record("total", timings.since_start())
+        phase_metrics.observe(timings)
+
+        # 2. Hand the turn (partial or not) to the write-behind queue; the client never waits on the DB
+        truncated = outcome != "completed"
+        # Request arrival to last delta, as the client experienced it
+        latency_ms = int(timings.phases["total"] * 1000)
+        rows = []
+        reply_row = None
+        if messages and messages[-1]["role"] == "user":
+            rows.append(_message_row(conversation_id, "user", messages[-1]["content"], user_created_at))
+        if parts or not truncated:
+            reply_row = _message_row(conversation_id, "assistant", "".join(parts), _now(), latency_ms, truncated)
+            rows.append(reply_row)
+        if rows:
+            recording = asyncio.create_task(_record_turn(conversation_id, user_id, rows, reply_row))
+            _pending_turns.add(recording)
+            recording.add_done_callback(_pending_turns.discard)
+
+    if outcome != "completed":
+        return
+
+    # A client may send its next message as soon as it sees message_stop, so
+    # the turn must be in the history cache by then
+    if recording is not None:
+        await asyncio.wait((recording,))
+    yield sse.CONTENT_BLOCK_STOP + sse.MESSAGE_STOP
@@ -0,0 +1,17 @@
+import os
+from functools import lru_cache
+
+import tiktoken
+
+# Groq's Llama/Mixtral tokenizers are not in tiktoken; cl100k_base is a close
+# enough estimate for budgeting and accounting.
+TOKEN_ENCODING = os.getenv("TOKEN_ENCODING", "cl100k_base")
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    return tiktoken.get_encoding(TOKEN_ENCODING)
+
+
+def count_tokens(text):
+    return len(_encoding().encode(text, disallowed_special=()))
@@ -0,0 +1,71 @@
+import time
+from bisect import bisect_left
+
+PHASES = ("auth", "history_load", "queue_wait", "ttft", "stream", "total")
+# Upper bounds in milliseconds, Prometheus style; the last bucket is +Inf
+BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+
+class RequestTimings:
+    """Phase durations for one streaming request, in seconds."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+
+    def record(self, phase, seconds):
+        self.phases[phase] = seconds
+
+    def since_start(self):
+        return time.perf_counter() - self.started
+
+
+def timings_for(request):
+    """The request's timings, created on first use (normally by auth, so they start early)."""
+    timings = getattr(request.state, "timings", None)
+    if timings is None:
+        timings = request.state.timings = RequestTimings()
+    return timings
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+
+    def observe(self, ms):
+        self.counts[bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.sum_ms += ms
+
+
+class PhaseMetrics:
+    def __init__(self):
+        self.histograms = {phase: Histogram() for phase in PHASES}
+
+    def observe(self, timings):
+        for phase, seconds in timings.phases.items():
+            histogram = self.histograms.get(phase)
+            if histogram is not None:
+                histogram.observe(seconds * 1000)
+
+    def render(self, gauges):
+        """Prometheus text exposition of the phase histograms plus `gauges` ({name: value})."""
+        lines = [
+            "# HELP chat_stream_phase_ms Time spent in each phase of a streaming request.",
+            "# TYPE chat_stream_phase_ms histogram",
+        ]
+        for phase, histogram in self.histograms.items():
+            cumulative = 0
+            for bound, count in zip(BUCKETS_MS + ("+Inf",), histogram.counts):
+                cumulative += count
+                lines.append(f'chat_stream_phase_ms_bucket{{phase="{phase}",le="{bound}"}} {cumulative}')
+            lines.append(f'chat_stream_phase_ms_sum{{phase="{phase}"}} {histogram.sum_ms:.3f}')
+            lines.append(f'chat_stream_phase_ms_count{{phase="{phase}"}} {histogram.count}')
+        for name, value in gauges.items():
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+phase_metrics = PhaseMetrics()
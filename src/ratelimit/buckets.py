@@ -0,0 +1,169 @@
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+RATE_PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+def parse_rate(rate):
+    """"10/minute" -> (capacity, refill per second)."""
+    amount, _, period = rate.partition("/")
+    seconds = RATE_PERIODS[period.strip().rstrip("s")]
+    capacity = float(amount)
+    return capacity, capacity / seconds
+
+
+def _refill(tokens, updated_at, now, capacity, rate, cost, force):
+    """One token-bucket step: (allowed, new tokens, seconds until `cost` fits)."""
+    tokens = min(capacity, tokens + max(0.0, now - updated_at) * rate)
+    if tokens >= cost:
+        return True, tokens - cost, 0.0
+    if force:
+        # Usage that already happened is always recorded; the debt delays
+        # the next request instead. Bounded so one huge reply can't lock a
+        # user out for more than a full refill period.
+        return True, max(tokens - cost, -capacity), 0.0
+    return False, tokens, (cost - tokens) / rate
+
+
+class MemoryBucketStore:
+    """Buckets in this process only. No locking: the event loop serialises access."""
+
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        self._buckets = {}
+
+    async def take(self, key, cost, capacity, rate, force=False):
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(key, (capacity, now))
+        allowed, tokens, retry_after = _refill(tokens, updated_at, now, capacity, rate, cost, force)
+        if key not in self._buckets and len(self._buckets) >= self.max_keys:
+            # Forgetting a bucket only resets it to full
+            self._buckets.pop(next(iter(self._buckets)))
+        self._buckets[key] = (tokens, now)
+        return allowed, retry_after
+
+
+class SharedMemoryBucketStore:
+    """Buckets in a memory-mapped file shared by every worker on the host.
+
+    The file is a fixed open-addressed table of (key hash, tokens, updated_at)
+    slots. Each access locks only the slot it touches with a byte-range lock,
+    so workers contend only when they hit the same slot.
+    """
+
+    SLOT = struct.Struct("<Qdd8x")
+    PROBES = 8
+
+    def __init__(self, path, slots=65536):
+        try:
+            import fcntl
+        except ImportError:
+            raise RuntimeError("RATE_LIMIT_BACKEND=shared needs POSIX file locks; use memory or redis here")
+        self._fcntl = fcntl
+        self.slots = slots
+        size = self.SLOT.size * slots
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+
+    @staticmethod
+    def _hash(key):
+        # 0 marks an empty slot
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") or 1
+
+    async def take(self, key, cost, capacity, rate, force=False):
+        key_hash = self._hash(key)
+        home = key_hash % self.slots
+        for probe in range(self.PROBES + 1):
+            # Table full around this key: take over its home slot, resetting it
+            index = (home + probe) % self.slots if probe < self.PROBES else home
+            offset = index * self.SLOT.size
+            self._fcntl.lockf(self._fd, self._fcntl.LOCK_EX, self.SLOT.size, offset)
+            try:
+                stored_hash, tokens, updated_at = self.SLOT.unpack_from(self._map, offset)
+                if stored_hash not in (key_hash, 0) and probe < self.PROBES:
+                    continue
+                now = time.monotonic()
+                if stored_hash != key_hash:
+                    tokens, updated_at = capacity, now
+                allowed, tokens, retry_after = _refill(tokens, updated_at, now, capacity, rate, cost, force)
+                self.SLOT.pack_into(self._map, offset, key_hash, tokens, now)
+                return allowed, retry_after
+            finally:
+                self._fcntl.lockf(self._fd, self._fcntl.LOCK_UN, self.SLOT.size, offset)
+
+
+# Runs atomically inside Redis; uses the server clock so app hosts needn't agree
+_REDIS_TAKE = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local force = ARGV[4] == "1"
+local clock = redis.call("TIME")
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call("HMGET", KEYS[1], "tokens", "ts")
+local tokens = tonumber(state[1]) or capacity
+local updated_at = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+  tokens = tokens - cost
+  allowed = 1
+elseif force then
+  tokens = math.max(tokens - cost, -capacity)
+  allowed = 1
+else
+  retry_after = (cost - tokens) / rate
+end
+redis.call("HSET", KEYS[1], "tokens", tokens, "ts", now)
+redis.call("EXPIRE", KEYS[1], math.ceil((capacity - tokens) / rate) + 1)
+return {allowed, tostring(retry_after)}
+"""
+
+
+class RedisBucketStore:
+    """Buckets in Redis (or any server speaking its protocol), shared across hosts.
+
+    One EVALSHA round trip per check. Pass `client` to use an existing
+    `redis.asyncio` compatible client, e.g. a local stand-in in tests.
+    """
+
+    def __init__(self, url=None, client=None, prefix="ratelimit:"):
+        if client is None:
+            import redis.asyncio as redis
+
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self._script = client.register_script(_REDIS_TAKE)
+
+    async def take(self, key, cost, capacity, rate, force=False):
+        allowed, retry_after = await self._script(
+            keys=[self.prefix + key],
+            args=[capacity, rate, cost, "1" if force else "0"],
+        )
+        return bool(allowed), float(retry_after)
+
+
+def _default_shared_path():
+    # /dev/shm keeps the table in RAM where it exists; otherwise any local temp dir will do
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, "ai-conversation-api-ratelimit")
+
+
+def create_bucket_store():
+    backend = os.getenv("RATE_LIMIT_BACKEND", "memory")
+    if backend == "shared":
+        return SharedMemoryBucketStore(
+            os.getenv("RATE_LIMIT_SHM_PATH") or _default_shared_path(),
+            int(os.getenv("RATE_LIMIT_SHM_SLOTS", "65536")),
+        )
+    if backend == "redis":
+        return RedisBucketStore(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+    return MemoryBucketStore()
@@ -0,0 +1,74 @@
+import asyncio
+import logging
+import math
+import os
+
+from dotenv import load_dotenv
+from fastapi import Depends, HTTPException
+
+from src.auth.dependencies import get_current_user
+from src.ratelimit.buckets import create_bucket_store, parse_rate
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_REQUESTS = os.getenv("RATE_LIMIT_REQUESTS", "10/minute")
+# Empty disables the per-user token quota
+RATE_LIMIT_TOKENS = os.getenv("RATE_LIMIT_TOKENS", "200000/hour")
+
+buckets = create_bucket_store()
+request_rate = parse_rate(RATE_LIMIT_REQUESTS)
+token_rate = parse_rate(RATE_LIMIT_TOKENS) if RATE_LIMIT_TOKENS else None
+
+# Completion charges run after the response; keep them referenced until done
+_pending_charges = set()
+
+
+def _too_many(detail, retry_after):
+    return HTTPException(
+        status_code=429,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+async def _take(key, cost, capacity, rate):
+    """`buckets.take`, failing open: an unreachable limiter must not take the API down with it."""
+    try:
+        return await buckets.take(key, cost, capacity, rate)
+    except Exception:
+        logger.exception("Rate limit backend failed; letting %s through", key)
+        return True, 0.0
+
+
+def _log_charge_failure(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Could not record completion tokens", exc_info=task.exception())
+
+
+async def rate_limit(user=Depends(get_current_user)):
+    """Per-user request limit; returns the user so routes can depend on this instead."""
+    allowed, retry_after = await _take(f"req:{user.id}", 1, *request_rate)
+    if not allowed:
+        raise _too_many(f"Rate limit exceeded: {RATE_LIMIT_REQUESTS}", retry_after)
+    return user
+
+
+async def charge_prompt_tokens(user_id, tokens):
+    """Reserve the prompt's tokens from the user's quota, or raise 429."""
+    if token_rate is None:
+        return
+    capacity, rate = token_rate
+    allowed, retry_after = await _take(f"tok:{user_id}", min(tokens, capacity), capacity, rate)
+    if not allowed:
+        raise _too_many(f"Token quota exceeded: {RATE_LIMIT_TOKENS}", retry_after)
+
+
+def charge_completion_tokens(user_id, tokens):
+    """Record generated tokens after the fact; never blocks the stream."""
+    if token_rate is None or not tokens:
+        return
+    task = asyncio.create_task(buckets.take(f"tok:{user_id}", tokens, *token_rate, force=True))
+    _pending_charges.add(task)
+    task.add_done_callback(_pending_charges.discard)
+    task.add_done_callback(_log_charge_failure)
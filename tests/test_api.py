@@ -0,0 +1,41 @@
+from fastapi.testclient import TestClient
+
+from src import main
+from src.auth.dependencies import get_current_user
+from src.auth.tokens import VerifiedUser
+from src.messages.dependencies import get_conversation
+from src.ratelimit.dependencies import rate_limit
+
+
+def _client(monkeypatch, conversation=None):
+    conversation = conversation or {"id": "c1", "user_id": "u1", "model": "llama3-8b-8192", "system_prompt": None}
+    monkeypatch.setitem(main.app.dependency_overrides, rate_limit, lambda: VerifiedUser({"sub": "u1"}))
+    monkeypatch.setitem(main.app.dependency_overrides, get_conversation, lambda: conversation)
+    return TestClient(main.app)
+
+
+def test_prompt_larger_than_the_context_window_is_refused_up_front(monkeypatch):
+    opened = []
+
+    async def open_reply(*args, **kwargs):
+        opened.append(args)
+
+    monkeypatch.setattr(main, "open_reply", open_reply)
+    client = _client(monkeypatch)
+
+    response = client.post("/api/v1/conversations/c1/messages/stream", json={"content": "word " * 10000})
+
+    assert response.status_code == 413
+    assert opened == []
+
+
+def test_malformed_conversation_id_is_404(monkeypatch):
+    fetched = []
+    monkeypatch.setattr("src.messages.dependencies.store.fetch_conversation", lambda cid: fetched.append(cid))
+    monkeypatch.setitem(main.app.dependency_overrides, get_current_user, lambda: VerifiedUser({"sub": "u1"}))
+    client = TestClient(main.app)
+
+    response = client.get("/api/v1/conversations/not-a-uuid/messages")
+
+    assert response.status_code == 404
+    assert fetched == []
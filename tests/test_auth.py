@@ -0,0 +1,173 @@
+import asyncio
+import json
+import time
+
+import httpx
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import HTTPException
+
+from src.auth import dependencies, tokens
+from src.auth.tokens import JWKSCache, LocalVerificationUnavailable, TokenCache, TokenVerifier, VerifiedUser
+
+SECRET = "test-secret-test-secret-test-secret"
+
+
+def _hs256(secret=SECRET, **overrides):
+    claims = {"sub": "u1", "aud": "authenticated", "role": "authenticated", "exp": int(time.time()) + 60}
+    claims.update(overrides)
+    return jwt.encode({key: value for key, value in claims.items() if value is not None}, secret, "HS256")
+
+
+def _rsa_jwk(kid):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    public = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+    return private_key, {**public, "kid": kid, "alg": "RS256", "use": "sig"}
+
+
+@pytest.fixture
+def jwks_server(monkeypatch):
+    """Routes the JWKS client to a handler; `state["keys"]` of None means the server is down."""
+    state = {"calls": 0, "keys": None}
+
+    async def handler(request):
+        state["calls"] += 1
+        await asyncio.sleep(0.01)
+        if state["keys"] is None:
+            raise httpx.ConnectError("down", request=request)
+        return httpx.Response(200, json={"keys": state["keys"]})
+
+    real_client = httpx.AsyncClient
+    monkeypatch.setattr(
+        tokens.httpx, "AsyncClient", lambda **kwargs: real_client(transport=httpx.MockTransport(handler), **kwargs)
+    )
+    return state
+
+
+def test_unknown_kids_refresh_once_during_an_outage(jwks_server):
+    async def scenario():
+        cache = JWKSCache("https://example.invalid/jwks.json")
+        results = await asyncio.gather(*(cache.get_key(f"kid-{index}") for index in range(20)))
+        for index in range(5):
+            results.append(await cache.get_key(f"late-{index}"))
+        return results
+
+    assert asyncio.run(scenario()) == [None] * 25
+    assert jwks_server["calls"] == 1
+
+
+def test_concurrent_requests_share_one_refresh(jwks_server):
+    private_key, jwk = _rsa_jwk("new")
+    jwks_server["keys"] = [jwk]
+
+    async def scenario():
+        cache = JWKSCache("https://example.invalid/jwks.json")
+        keys = await asyncio.gather(*(cache.get_key("new") for _ in range(10)))
+        token = jwt.encode({"sub": "u1", "aud": "authenticated", "exp": 2**31}, private_key, "RS256", {"kid": "new"})
+        return keys, await TokenVerifier(jwks=cache).verify(token)
+
+    keys, claims = asyncio.run(scenario())
+
+    assert all(key is not None for key in keys)
+    assert jwks_server["calls"] == 1
+    assert claims["sub"] == "u1"
+
+
+def test_accepts_a_valid_hs256_token():
+    claims = asyncio.run(TokenVerifier(secret=SECRET).verify(_hs256()))
+
+    assert VerifiedUser(claims).id == "u1"
+
+
+@pytest.mark.parametrize(
+    "token",
+    [
+        _hs256(secret="another-secret-another-secret-another"),
+        _hs256(aud="someone-else"),
+        _hs256(exp=int(time.time()) - 60),
+        _hs256(sub=None),
+        jwt.encode({"sub": "u1", "aud": "authenticated", "exp": 2**31}, None, algorithm="none"),
+        jwt.encode({"sub": "u1", "aud": "authenticated", "exp": 2**31}, SECRET * 2, algorithm="HS512"),
+    ],
+    ids=["bad-signature", "wrong-audience", "expired", "missing-sub", "alg-none", "unexpected-alg"],
+)
+def test_rejects_bad_tokens(token):
+    with pytest.raises(jwt.InvalidTokenError):
+        asyncio.run(TokenVerifier(secret=SECRET).verify(token))
+
+
+def test_no_local_key_means_unavailable():
+    with pytest.raises(LocalVerificationUnavailable):
+        asyncio.run(TokenVerifier(secret=None).verify(_hs256()))
+
+
+def test_token_cache_drops_entries_at_exp(monkeypatch):
+    cache = TokenCache()
+    now = time.time()
+    cache.put("live", "user", now + 10)
+    cache.put("stale", "user", now - 1)
+
+    monkeypatch.setattr(tokens.time, "time", lambda: now + 20)
+
+    assert cache.get("live") is None
+    assert len(cache) == 0
+
+
+def test_token_cache_evicts_least_recently_used():
+    cache = TokenCache(maxsize=2)
+    expires_at = time.time() + 60
+    cache.put("a", "user-a", expires_at)
+    cache.put("b", "user-b", expires_at)
+    cache.get("a")
+    cache.put("c", "user-c", expires_at)
+
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == ("user-a", "user-c")
+
+
+@pytest.fixture
+def authenticate(monkeypatch):
+    """`_authenticate` in local mode with a fresh cache and a stubbed Supabase round trip."""
+    remote_calls = []
+
+    async def verify_remote(token):
+        remote_calls.append(token)
+        return VerifiedUser({"sub": "remote-user"}), time.time() + 60
+
+    monkeypatch.setattr(dependencies, "AUTH_VERIFY_MODE", "local")
+    monkeypatch.setattr(dependencies, "token_cache", TokenCache())
+    monkeypatch.setattr(dependencies, "_verify_remote", verify_remote)
+
+    def run(token, verifier):
+        monkeypatch.setattr(dependencies, "verifier", verifier)
+        return asyncio.run(dependencies._authenticate(token))
+
+    run.remote_calls = remote_calls
+    return run
+
+
+def test_falls_back_to_supabase_when_no_local_key_applies(authenticate):
+    user = authenticate(_hs256(), TokenVerifier(secret=None))
+
+    assert user.id == "remote-user"
+    assert len(authenticate.remote_calls) == 1
+
+
+def test_verified_users_are_cached(authenticate):
+    token = _hs256()
+    verifier = TokenVerifier(secret=SECRET)
+
+    first = authenticate(token, verifier)
+    second = authenticate(token, TokenVerifier(secret="changed-changed-changed-changed-123"))
+
+    assert first is second
+    assert authenticate.remote_calls == []
+
+
+def test_bad_tokens_are_401_without_asking_supabase(authenticate):
+    with pytest.raises(HTTPException) as excinfo:
+        authenticate(_hs256(secret="another-secret-another-secret-another"), TokenVerifier(secret=SECRET))
+
+    assert excinfo.value.status_code == 401
+    assert authenticate.remote_calls == []
@@ -0,0 +1,109 @@
+import asyncio
+import importlib
+import sys
+
+import pytest
+
+from src.ratelimit import buckets
+from src.ratelimit.buckets import MemoryBucketStore, RedisBucketStore, SharedMemoryBucketStore, parse_rate
+
+
+def _redis_store():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    return RedisBucketStore(client=fakeredis.FakeAsyncRedis())
+
+
+@pytest.fixture(params=["memory", "shared", "redis"])
+def make_store(request, tmp_path):
+    def make():
+        if request.param == "memory":
+            return MemoryBucketStore()
+        if request.param == "shared":
+            return SharedMemoryBucketStore(str(tmp_path / "buckets"), slots=64)
+        return _redis_store()
+
+    return make
+
+
+def test_parse_rate():
+    assert parse_rate("10/minute") == (10.0, 10 / 60)
+    assert parse_rate("200000/hours") == (200000.0, 200000 / 3600)
+
+
+def test_allows_up_to_capacity_then_refuses(make_store):
+    async def scenario():
+        store = make_store()
+        results = [await store.take("user", 1, 3, 0.001) for _ in range(4)]
+        return results
+
+    results = asyncio.run(scenario())
+
+    assert [allowed for allowed, _ in results] == [True, True, True, False]
+    assert results[-1][1] == pytest.approx(1000, rel=0.01)
+
+
+def test_keys_are_independent(make_store):
+    async def scenario():
+        store = make_store()
+        await store.take("a", 5, 5, 0.001)
+        return await store.take("b", 5, 5, 0.001)
+
+    assert asyncio.run(scenario())[0]
+
+
+def test_forced_usage_goes_into_bounded_debt(make_store):
+    async def scenario():
+        store = make_store()
+        forced = await store.take("user", 50, 10, 1.0, force=True)
+        refused = await store.take("user", 1, 10, 1.0)
+        return forced, refused
+
+    forced, refused = asyncio.run(scenario())
+
+    assert forced == (True, 0.0)
+    assert not refused[0]
+    # Debt is capped at one capacity: 10 below zero, plus the 1 requested
+    assert refused[1] == pytest.approx(11, rel=0.01)
+
+
+def test_refills_over_time(make_store):
+    async def scenario():
+        store = make_store()
+        await store.take("user", 2, 2, 100.0)
+        await asyncio.sleep(0.05)
+        return await store.take("user", 2, 2, 100.0)
+
+    assert asyncio.run(scenario())[0]
+
+
+def test_shared_buckets_are_seen_by_every_mapping(tmp_path):
+    async def scenario():
+        first = SharedMemoryBucketStore(str(tmp_path / "buckets"), slots=64)
+        second = SharedMemoryBucketStore(str(tmp_path / "buckets"), slots=64)
+        await first.take("user", 2, 2, 0.001)
+        return await second.take("user", 1, 2, 0.001)
+
+    assert not asyncio.run(scenario())[0]
+
+
+def test_shared_table_reuses_a_slot_when_full(tmp_path):
+    async def scenario():
+        store = SharedMemoryBucketStore(str(tmp_path / "buckets"), slots=2)
+        return [await store.take(f"user-{index}", 1, 1, 0.001) for index in range(5)]
+
+    assert all(allowed for allowed, _ in asyncio.run(scenario()))
+
+
+def test_only_the_shared_backend_needs_fcntl(monkeypatch, tmp_path):
+    # As on Windows, where the module does not exist
+    monkeypatch.setitem(sys.modules, "fcntl", None)
+    monkeypatch.setenv("RATE_LIMIT_BACKEND", "memory")
+    module = importlib.reload(buckets)
+    try:
+        assert isinstance(module.create_bucket_store(), module.MemoryBucketStore)
+        with pytest.raises(RuntimeError, match="POSIX"):
+            module.SharedMemoryBucketStore(str(tmp_path / "buckets"), slots=8)
+    finally:
+        monkeypatch.undo()
+        importlib.reload(buckets)
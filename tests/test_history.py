@@ -0,0 +1,135 @@
+import asyncio
+
+from src.messages import history as history_module
+from src.messages.history import ConversationHistory, HistoryCache
+from src.messages.store import SQLiteStore
+
+
+def _row(index, content="word", conversation_id="c1"):
+    return {
+        "id": f"m{index:04d}",
+        "conversation_id": conversation_id,
+        "role": "user" if index % 2 == 0 else "assistant",
+        "content": content,
+        "token_count": None,
+        "latency_ms": None,
+        "is_truncated": False,
+        "created_at": f"2024-01-01T00:{index // 60:02d}:{index % 60:02d}+00:00",
+    }
+
+
+class CountingStore:
+    def __init__(self, store):
+        self.store = store
+        self.calls = []
+
+    def fetch_latest_messages(self, conversation_id, limit):
+        self.calls.append(("latest", None))
+        return self.store.fetch_latest_messages(conversation_id, limit)
+
+    def fetch_messages_after(self, conversation_id, after):
+        rows = self.store.fetch_messages_after(conversation_id, after)
+        self.calls.append(("after", len(rows)))
+        return rows
+
+
+def test_loads_only_new_rows_after_the_first():
+    store = CountingStore(SQLiteStore(":memory:"))
+    store.store.insert_messages([_row(index) for index in range(4)])
+    cache = HistoryCache(store)
+
+    asyncio.run(cache.load("c1"))
+    store.store.insert_messages([_row(4), _row(5)])
+    history = asyncio.run(cache.load("c1"))
+
+    assert store.calls == [("latest", None), ("after", 2)]
+    assert [row["id"] for row in history.messages] == [f"m{index:04d}" for index in range(6)]
+    assert history.tokens == 6 * (1 + history_module.MESSAGE_TOKEN_OVERHEAD)
+
+
+def test_local_appends_are_not_fetched_twice():
+    store = SQLiteStore(":memory:")
+    store.insert_messages([_row(0), _row(1)])
+    cache = HistoryCache(store)
+    asyncio.run(cache.load("c1"))
+
+    local = [_row(2), _row(3)]
+    cache.append("c1", local)
+    store.insert_messages(local)
+    history = asyncio.run(cache.load("c1"))
+
+    assert [row["id"] for row in history.messages] == ["m0000", "m0001", "m0002", "m0003"]
+
+
+def test_late_rows_from_another_worker_are_not_skipped():
+    store = SQLiteStore(":memory:")
+    store.insert_messages([_row(0), _row(1)])
+    cache = HistoryCache(store)
+    asyncio.run(cache.load("c1"))
+
+    # This worker's turn is cached locally; another worker's older turn lands afterwards
+    cache.append("c1", [_row(20), _row(21)])
+    store.insert_messages([_row(10), _row(11)])
+    history = asyncio.run(cache.load("c1"))
+
+    assert [row["id"] for row in history.messages] == ["m0000", "m0001", "m0010", "m0011", "m0020", "m0021"]
+
+
+def test_entry_evicted_during_a_load_is_reloaded_in_full():
+    store = SQLiteStore(":memory:")
+    store.insert_messages([_row(index) for index in range(10)])
+    cache = HistoryCache(store)
+    asyncio.run(cache.load("c1"))
+    store.insert_messages([_row(10)])
+
+    fetch_after = store.fetch_messages_after
+
+    def evict_then_fetch(conversation_id, after):
+        # Another load pushes this conversation out while the query runs
+        cache.bytes -= cache._entries.pop(conversation_id).bytes
+        return fetch_after(conversation_id, after)
+
+    store.fetch_messages_after = evict_then_fetch
+    history = asyncio.run(cache.load("c1"))
+
+    assert len(history.messages) == 11
+    assert cache._entries["c1"] is history
+
+
+def test_trim_keeps_the_newest_rows(monkeypatch):
+    monkeypatch.setattr(history_module, "HISTORY_MAX_CACHED_TOKENS", 3 * (1 + history_module.MESSAGE_TOKEN_OVERHEAD))
+    history = ConversationHistory()
+
+    history.extend([history_module._prepare(_row(index)) for index in range(5)], fetched=True)
+    history.extend([history_module._prepare(_row(1))], fetched=True)
+
+    assert [row["id"] for row in history.messages] == ["m0002", "m0003", "m0004"]
+    assert history.fetched == (_row(4)["created_at"], "m0004")
+
+
+def test_evicts_least_recently_used_conversations():
+    store = SQLiteStore(":memory:")
+    store.insert_messages([_row(0, "x" * 100, "a"), _row(1, "y" * 100, "b")])
+    cache = HistoryCache(store, max_bytes=150)
+
+    asyncio.run(cache.load("a"))
+    asyncio.run(cache.load("b"))
+
+    assert list(cache._entries) == ["b"]
+    assert cache.bytes == 100
+
+
+def test_context_keeps_newest_messages_within_the_window(monkeypatch):
+    monkeypatch.setattr(history_module, "RESPONSE_TOKEN_RESERVE", 0)
+    monkeypatch.setitem(history_module.MODEL_CONTEXT_WINDOWS, "tiny", 2 * (1 + history_module.MESSAGE_TOKEN_OVERHEAD) + 5)
+    history = ConversationHistory()
+    history.extend([history_module._prepare(_row(index, f"turn{index}")) for index in range(4)])
+
+    messages, tokens = history.context("tiny", "next")
+
+    assert [message["content"] for message in messages] == ["turn2", "turn3", "next"]
+    assert tokens == 3 * (1 + history_module.MESSAGE_TOKEN_OVERHEAD)
+
+
+def test_cached_tail_covers_the_largest_context_window():
+    assert history_module.HISTORY_MAX_CACHED_TOKENS >= max(history_module.MODEL_CONTEXT_WINDOWS.values())
@@ -0,0 +1,54 @@
+from benchmarks.loadtest import percentile
+from src.metrics import BUCKETS_MS, PhaseMetrics, RequestTimings
+
+
+def _timings(**phases):
+    timings = RequestTimings()
+    for phase, seconds in phases.items():
+        timings.record(phase, seconds)
+    return timings
+
+
+def test_observations_land_in_the_first_bucket_that_holds_them():
+    metrics = PhaseMetrics()
+    for seconds in (0.0005, 0.001, 0.003, 120.0):
+        metrics.observe(_timings(ttft=seconds))
+
+    counts = metrics.histograms["ttft"].counts
+    # 0.5 ms and exactly 1 ms are both le="1"; 3 ms is le="5"; 2 minutes only fits +Inf
+    assert counts[0] == 2
+    assert counts[BUCKETS_MS.index(5)] == 1
+    assert counts[-1] == 1
+    assert metrics.histograms["ttft"].count == 4
+
+
+def test_unknown_phases_are_ignored():
+    metrics = PhaseMetrics()
+    metrics.observe(_timings(ttft=0.01, something_else=1.0))
+
+    assert set(metrics.histograms) == {"auth", "history_load", "queue_wait", "ttft", "stream", "total"}
+
+
+def test_render_is_cumulative_prometheus_text():
+    metrics = PhaseMetrics()
+    metrics.observe(_timings(total=0.004))
+    metrics.observe(_timings(total=0.2))
+
+    lines = metrics.render({"persistence_queue_depth": 3}).splitlines()
+
+    assert "# TYPE chat_stream_phase_ms histogram" in lines
+    assert 'chat_stream_phase_ms_bucket{phase="total",le="2.5"} 0' in lines
+    assert 'chat_stream_phase_ms_bucket{phase="total",le="5"} 1' in lines
+    assert 'chat_stream_phase_ms_bucket{phase="total",le="250"} 2' in lines
+    assert 'chat_stream_phase_ms_bucket{phase="total",le="+Inf"} 2' in lines
+    assert 'chat_stream_phase_ms_sum{phase="total"} 204.000' in lines
+    assert 'chat_stream_phase_ms_count{phase="total"} 2' in lines
+    assert 'chat_stream_phase_ms_count{phase="auth"} 0' in lines
+    assert lines[-1] == "persistence_queue_depth 3"
+
+
+def test_load_test_percentiles_use_nearest_rank():
+    assert percentile(range(1, 101), 95) == 95
+    assert percentile(range(1, 11), 50) == 5
+    assert percentile(range(1, 11), 99) == 10
+    assert percentile([7], 50) == 7
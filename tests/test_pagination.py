@@ -0,0 +1,33 @@
+import base64
+import uuid
+
+import pytest
+from fastapi import HTTPException
+
+from src.messages.pagination import decode_cursor, encode_cursor
+
+
+def _raw_cursor(text):
+    return base64.urlsafe_b64encode(text.encode()).decode().rstrip("=")
+
+
+def test_round_trip():
+    row = {"created_at": "2024-01-01T00:00:00.12345+00:00", "id": str(uuid.uuid4())}
+
+    assert decode_cursor(encode_cursor(row)) == (row["created_at"], row["id"])
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "not base64!",
+        _raw_cursor("no separator"),
+        _raw_cursor(f'2024-01-01T00:00:00",id.gt.0|{uuid.uuid4()}'),
+        _raw_cursor("2024-01-01T00:00:00+00:00|1),conversation_id.neq.(x"),
+    ],
+)
+def test_rejects_malformed_cursors(cursor):
+    with pytest.raises(HTTPException) as excinfo:
+        decode_cursor(cursor)
+
+    assert excinfo.value.status_code == 400
@@ -0,0 +1,119 @@
+import asyncio
+import uuid
+
+import pytest
+
+from src.messages.persistence import MessageWriter
+from src.messages.schemas import MessageCreate
+from src.messages.store import SQLiteStore
+
+
+def _row(conversation_id="c1", content="hello there", created_at="2024-01-01T00:00:00+00:00"):
+    return {
+        "id": str(uuid.uuid4()),
+        "conversation_id": conversation_id,
+        "role": "user",
+        "content": content,
+        "token_count": None,
+        "latency_ms": None,
+        "is_truncated": False,
+        "created_at": created_at,
+    }
+
+
+class FlakyStore:
+    """Wraps a store, failing the first `failures` inserts and any insert containing `poison`."""
+
+    def __init__(self, store, failures=0, poison=None):
+        self.store = store
+        self.failures = failures
+        self.poison = poison
+        self.calls = []
+
+    def insert_messages(self, rows):
+        self.calls.append(len(rows))
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("transient")
+        if any(row["content"] == self.poison for row in rows):
+            raise RuntimeError("rejected")
+        self.store.insert_messages(rows)
+
+
+def _count(store):
+    return len(store._select("SELECT id FROM messages", (), ("id",)))
+
+
+async def _drain(writer, turns):
+    writer.start()
+    for turn in turns:
+        writer.enqueue(*turn)
+    await writer.stop()
+
+
+def test_turns_are_batched_into_one_insert():
+    store = FlakyStore(SQLiteStore(":memory:"))
+    writer = MessageWriter(store, batch_size=100, flush_ms=50)
+
+    asyncio.run(_drain(writer, [[_row(), _row()] for _ in range(5)]))
+
+    assert store.calls == [10]
+    assert _count(store.store) == 10
+    assert writer.stats["batches"] == 1
+    assert writer.stats["written"] == 10
+
+
+def test_token_counts_are_filled_in():
+    store = SQLiteStore(":memory:")
+    writer = MessageWriter(store, flush_ms=0)
+
+    asyncio.run(_drain(writer, [[_row(content="one two three")]]))
+
+    assert store._select("SELECT token_count FROM messages", (), ("token_count",)) == [{"token_count": 3}]
+
+
+def test_transient_failures_are_retried():
+    store = FlakyStore(SQLiteStore(":memory:"), failures=2)
+    writer = MessageWriter(store, flush_ms=0, max_retries=3)
+
+    asyncio.run(_drain(writer, [[_row()]]))
+
+    assert store.calls == [1, 1, 1]
+    assert _count(store.store) == 1
+    assert writer.stats["failed"] == 0
+
+
+def test_a_bad_turn_does_not_drop_the_rest_of_the_batch():
+    store = FlakyStore(SQLiteStore(":memory:"), poison="bad")
+    writer = MessageWriter(store, batch_size=100, flush_ms=50, max_retries=1)
+    turns = [[_row(), _row()] for _ in range(6)]
+    turns[3] = [_row(), _row(content="bad")]
+
+    asyncio.run(_drain(writer, turns))
+
+    assert _count(store.store) == 10
+    assert writer.stats["written"] == 10
+    assert writer.stats["failed"] == 2
+
+
+def test_rows_already_written_are_ignored():
+    store = SQLiteStore(":memory:")
+    rows = [_row(), _row()]
+    store.insert_messages(rows[:1])
+
+    store.insert_messages(rows)
+
+    assert _count(store) == 2
+
+
+def test_queue_full_drops_rows():
+    writer = MessageWriter(SQLiteStore(":memory:"), max_queue=1)
+
+    assert writer.enqueue(_row())
+    assert not writer.enqueue(_row(), _row())
+    assert writer.stats["dropped"] == 2
+
+
+def test_message_content_rejects_nul():
+    with pytest.raises(ValueError):
+        MessageCreate(content="hello\x00world")
@@ -0,0 +1,60 @@
+import asyncio
+import logging
+
+import pytest
+from fastapi import HTTPException
+
+from src.auth.tokens import VerifiedUser
+from src.ratelimit import dependencies
+from src.ratelimit.buckets import MemoryBucketStore
+
+
+class BrokenBuckets:
+    async def take(self, key, cost, capacity, rate, force=False):
+        raise ConnectionError("limiter is down")
+
+
+def test_requests_over_the_limit_get_429(monkeypatch):
+    monkeypatch.setattr(dependencies, "buckets", MemoryBucketStore())
+    monkeypatch.setattr(dependencies, "request_rate", (2.0, 0.001))
+    user = VerifiedUser({"sub": "u1"})
+
+    async def scenario():
+        for _ in range(2):
+            await dependencies.rate_limit(user)
+        await dependencies.rate_limit(user)
+
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(scenario())
+
+    assert excinfo.value.status_code == 429
+    assert int(excinfo.value.headers["Retry-After"]) >= 1
+
+
+def test_backend_failures_let_requests_through(monkeypatch, caplog):
+    monkeypatch.setattr(dependencies, "buckets", BrokenBuckets())
+    monkeypatch.setattr(dependencies, "token_rate", (100.0, 1.0))
+    user = VerifiedUser({"sub": "u1"})
+
+    async def scenario():
+        result = await dependencies.rate_limit(user)
+        await dependencies.charge_prompt_tokens(user.id, 10)
+        return result
+
+    assert asyncio.run(scenario()) is user
+    assert "Rate limit backend failed" in caplog.text
+
+
+def test_failed_completion_charges_are_logged(monkeypatch, caplog):
+    monkeypatch.setattr(dependencies, "buckets", BrokenBuckets())
+    monkeypatch.setattr(dependencies, "token_rate", (100.0, 1.0))
+
+    async def scenario():
+        dependencies.charge_completion_tokens("u1", 10)
+        await asyncio.gather(*dependencies._pending_charges, return_exceptions=True)
+        await asyncio.sleep(0)
+
+    with caplog.at_level(logging.ERROR):
+        asyncio.run(scenario())
+
+    assert "Could not record completion tokens" in caplog.text
@@ -0,0 +1,120 @@
+import asyncio
+
+import groq
+import httpx
+import pytest
+
+from src.auth.tokens import VerifiedUser
+from src.messages import scheduler as scheduler_module
+from src.messages.scheduler import SchedulerOverloaded, UpstreamScheduler, _retry_delay, priority_for
+
+
+def test_grants_up_to_the_model_limit_without_queueing():
+    async def scenario():
+        scheduler = UpstreamScheduler(default_limit=2, limits={"big": 1})
+        slots = [await scheduler.acquire("small"), await scheduler.acquire("small"), await scheduler.acquire("big")]
+        return scheduler, slots
+
+    scheduler, slots = asyncio.run(scenario())
+
+    assert all(slot.wait_ms < 50 for slot in slots)
+    assert scheduler.counters["granted"] == 3
+
+
+def test_higher_priority_waiters_go_first():
+    async def scenario():
+        scheduler = UpstreamScheduler(default_limit=1)
+        slot = await scheduler.acquire("m")
+        order = []
+
+        async def wait(name, priority):
+            granted = await scheduler.acquire("m", priority, timeout=1)
+            order.append(name)
+            granted.release()
+
+        tasks = [asyncio.create_task(wait("low", 0)), asyncio.create_task(wait("high", 10))]
+        await asyncio.sleep(0)
+        slot.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["high", "low"]
+
+
+def test_full_queue_is_rejected_immediately():
+    async def scenario():
+        scheduler = UpstreamScheduler(default_limit=1, max_queue=1)
+        await scheduler.acquire("m")
+        waiting = asyncio.create_task(scheduler.acquire("m", timeout=1))
+        await asyncio.sleep(0)
+        with pytest.raises(SchedulerOverloaded):
+            await scheduler.acquire("m")
+        waiting.cancel()
+        return scheduler
+
+    scheduler = asyncio.run(scenario())
+
+    assert scheduler.counters["rejected"] == 1
+    assert scheduler.queued == 0
+
+
+def test_waiters_give_up_at_the_deadline():
+    async def scenario():
+        scheduler = UpstreamScheduler(default_limit=1)
+        slot = await scheduler.acquire("m")
+        with pytest.raises(SchedulerOverloaded):
+            await scheduler.acquire("m", timeout=0.01)
+        slot.release()
+        # The expired waiter must not have taken the freed slot
+        return scheduler, await scheduler.acquire("m", timeout=0.01)
+
+    scheduler, slot = asyncio.run(scenario())
+
+    assert scheduler.counters["timed_out"] == 1
+    assert scheduler.stats()["queued"] == 0
+    assert slot.wait_ms < 50
+
+
+def test_release_is_idempotent():
+    async def scenario():
+        scheduler = UpstreamScheduler(default_limit=1)
+        slot = await scheduler.acquire("m")
+        slot.release()
+        slot.release()
+        return scheduler._lane("m").active
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_priority_comes_from_the_users_plan(monkeypatch):
+    monkeypatch.setattr(scheduler_module, "SCHEDULER_PLAN_PRIORITIES", {"pro": 10})
+
+    assert priority_for(VerifiedUser({"sub": "u", "app_metadata": {"plan": "pro"}})) == 10
+    assert priority_for(VerifiedUser({"sub": "u", "app_metadata": {"plan": "free"}})) == 0
+    assert priority_for(VerifiedUser({"sub": "u"})) == 0
+
+
+def _rate_limited(headers):
+    request = httpx.Request("POST", "https://api.groq.com/openai/v1/chat/completions")
+    return groq.RateLimitError("rate limited", response=httpx.Response(429, headers=headers, request=request), body=None)
+
+
+@pytest.mark.parametrize(
+    "headers, expected",
+    [
+        ({"retry-after": "2", "x-ratelimit-reset-tokens": "7.5s"}, 2.0),
+        ({"x-ratelimit-reset-requests": "200ms", "x-ratelimit-reset-tokens": "1m0.5s"}, 60.5),
+        (
+            {
+                "x-ratelimit-reset-requests": "2m",
+                "x-ratelimit-remaining-requests": "10",
+                "x-ratelimit-reset-tokens": "1.5s",
+                "x-ratelimit-remaining-tokens": "0",
+            },
+            1.5,
+        ),
+        ({}, 0.5),
+    ],
+)
+def test_retry_delay_waits_for_the_limit_that_was_hit(headers, expected):
+    assert _retry_delay(_rate_limited(headers), attempt=1) == pytest.approx(expected)
@@ -0,0 +1,93 @@
+import asyncio
+import json
+
+import pytest
+
+from src.messages import sse, streaming
+
+TEXTS = ["Hello", "naïve café — 日本語 🙂", 'quotes " and \\ backslash', "line\nbreak\ttab", "  ", "</script>"]
+
+
+def _parse(frame):
+    """(event, data) from one SSE frame."""
+    event_line, data_line = frame.decode().rstrip("\n").split("\n")
+    assert event_line.startswith("event: ") and data_line.startswith("data: ")
+    return event_line[len("event: "):], json.loads(data_line[len("data: "):])
+
+
+def _legacy(event, data):
+    # The frames stream_generator built before the encoding layer
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+
+@pytest.fixture(params=["orjson", "json"])
+def encoder(request, monkeypatch):
+    if request.param == "json":
+        monkeypatch.setattr(sse, "orjson", None)
+        monkeypatch.setattr(sse, "dumps", lambda obj: json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode())
+    elif sse.orjson is None:
+        pytest.skip("orjson is not installed")
+    return sse
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_delta_frames_match_the_legacy_schema(encoder, text):
+    frame = encoder.content_block_delta(text)
+
+    assert frame.endswith(b"\n\n")
+    assert _parse(frame) == _parse(_legacy("content_block_delta", {"delta": {"text": text}}))
+
+
+def test_static_frames_match_the_legacy_schema():
+    legacy = {
+        sse.CONTENT_BLOCK_START: _legacy("content_block_start", {"index": 0}),
+        sse.CONTENT_BLOCK_STOP: _legacy("content_block_stop", {"index": 0}),
+        sse.MESSAGE_STOP: _legacy("message_stop", {}),
+        sse.message_start("llama3-8b-8192"): _legacy(
+            "message_start", {"type": "message_start", "message": {"role": "assistant", "model": "llama3-8b-8192"}}
+        ),
+    }
+
+    for frame, expected in legacy.items():
+        assert _parse(frame) == _parse(expected)
+
+
+async def _collect(items, window=0.05, max_bytes=1024, delay=0.0):
+    queue = asyncio.Queue()
+
+    async def feed():
+        for item in items:
+            queue.put_nowait(item)
+            if delay:
+                await asyncio.sleep(delay)
+
+    feeder = asyncio.create_task(feed())
+    chunks = [chunk async for chunk in streaming._coalesce(queue, window, max_bytes)]
+    await feeder
+    return chunks
+
+
+def test_first_delta_goes_out_alone_and_the_rest_merge():
+    chunks = asyncio.run(_collect(["a", "b", "c", "d", streaming._DONE]))
+
+    assert chunks == ["a", "bcd", streaming._DONE]
+
+
+def test_merging_stops_at_max_bytes():
+    # "é" is two bytes in UTF-8, so three of them pass a 5-byte budget
+    chunks = asyncio.run(_collect(["x", "é", "é", "é", "é", streaming._DONE], max_bytes=5))
+
+    assert chunks == ["x", "ééé", "é", streaming._DONE]
+
+
+def test_merging_stops_when_the_window_closes():
+    chunks = asyncio.run(_collect(["a", "b", "c", streaming._DONE], window=0.01, delay=0.05))
+
+    assert chunks == ["a", "b", "c", streaming._DONE]
+
+
+@pytest.mark.parametrize("terminal", [streaming._DONE, streaming._DISCONNECTED, RuntimeError("upstream")])
+def test_terminal_markers_pass_through(terminal):
+    chunks = asyncio.run(_collect(["a", "b", terminal]))
+
+    assert chunks == ["a", "b", terminal]
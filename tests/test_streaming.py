@@ -0,0 +1,204 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from src.messages import streaming
+from src.messages.cache import ResponseCache
+from src.messages.history import HistoryCache
+from src.messages.scheduler import UpstreamScheduler
+from src.messages.store import SQLiteStore
+from src.messages.tokens import count_tokens
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+class FakeStream:
+    def __init__(self, deltas, delay):
+        self.deltas = deltas
+        self.delay = delay
+        self.closed = False
+
+    async def __aiter__(self):
+        for delta in self.deltas:
+            await asyncio.sleep(self.delay)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=delta))])
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Replaces the provider with a fake stream and enables a fresh response cache."""
+    streams = []
+
+    async def create_stream(client, **kwargs):
+        stream = FakeStream(["Hel", "lo"], delay=0.01)
+        streams.append(stream)
+        return stream
+
+    monkeypatch.setattr(streaming, "create_stream", create_stream)
+    monkeypatch.setattr(streaming, "response_cache", ResponseCache(enabled=True))
+    return streams
+
+
+async def _read(reply, timeout=1.0):
+    parts = []
+    while True:
+        item = await asyncio.wait_for(reply.queue.get(), timeout)
+        if not isinstance(item, str):
+            return "".join(parts), item
+        parts.append(item)
+
+
+def test_identical_requests_share_one_generation(upstream):
+    async def scenario():
+        replies = [await streaming.open_reply(MESSAGES, "m") for _ in range(3)]
+        return await asyncio.gather(*(_read(reply) for reply in replies))
+
+    results = asyncio.run(scenario())
+
+    assert results == [("Hello", streaming._DONE)] * 3
+    assert len(upstream) == 1
+    assert streaming.response_cache.counters["joined"] == 2
+
+
+def test_completed_replies_are_served_from_the_cache(upstream):
+    async def scenario():
+        await _read(await streaming.open_reply(MESSAGES, "m"))
+        await asyncio.sleep(0)
+        return await _read(await streaming.open_reply(MESSAGES, "m"))
+
+    assert asyncio.run(scenario()) == ("Hello", streaming._DONE)
+    assert len(upstream) == 1
+    assert streaming.response_cache.counters["hits"] == 1
+
+
+def test_request_after_the_last_reader_leaves_starts_afresh(upstream):
+    async def scenario():
+        first = await streaming.open_reply(MESSAGES, "m")
+        await asyncio.sleep(0)
+        first.detach()
+        # Same tick: the cancelled generation hasn't finished unwinding yet
+        second = await streaming.open_reply(MESSAGES, "m")
+        return first, second, await _read(second)
+
+    first, second, result = asyncio.run(scenario())
+
+    assert second._generation is not first._generation
+    assert result == ("Hello", streaming._DONE)
+    assert len(upstream) == 2 and upstream[0].closed
+
+
+def test_subscribers_of_a_cancelled_generation_get_a_terminal(upstream):
+    async def scenario():
+        first = await streaming.open_reply(MESSAGES, "m")
+        await asyncio.sleep(0)
+        first.detach()
+        late = first._generation.subscribe()
+        return await _read(streaming.Reply(late))
+
+    text, terminal = asyncio.run(scenario())
+
+    assert isinstance(terminal, streaming.GenerationCancelled)
+
+
+class FakeWriter:
+    def __init__(self):
+        self.rows = []
+
+    def enqueue(self, *rows):
+        self.rows.extend(rows)
+        return True
+
+
+def test_turns_are_counted_off_the_event_loop(monkeypatch):
+    threads = []
+    charges = []
+    writer = FakeWriter()
+
+    def counting(text):
+        threads.append(threading.get_ident())
+        return count_tokens(text)
+
+    monkeypatch.setattr(streaming, "count_tokens", counting)
+    monkeypatch.setattr(streaming, "writer", writer)
+    monkeypatch.setattr(streaming, "charge_completion_tokens", lambda user_id, tokens: charges.append((user_id, tokens)))
+
+    async def scenario():
+        user = streaming._message_row("c1", "user", "two words", streaming._now())
+        reply = streaming._message_row("c1", "assistant", "three more words", streaming._now(), 10)
+        await streaming._record_turn("c1", "u1", [user, reply], reply)
+        await streaming.flush_turns()
+
+    asyncio.run(scenario())
+
+    assert threads and threading.get_ident() not in threads
+    assert [row["token_count"] for row in writer.rows] == [2, 3]
+    assert charges == [("u1", 3)]
+
+
+class FakeRequest:
+    def __init__(self):
+        self.state = SimpleNamespace()
+        self.disconnected = False
+
+    async def is_disconnected(self):
+        return self.disconnected
+
+
+def test_client_disconnect_cancels_upstream_and_keeps_the_partial_reply(monkeypatch):
+    streams = []
+    writer = FakeWriter()
+    scheduler = UpstreamScheduler(default_limit=1)
+
+    async def create_stream(client, **kwargs):
+        streams.append(FakeStream([f"part{index} " for index in range(50)], delay=0.02))
+        return streams[-1]
+
+    monkeypatch.setattr(streaming, "create_stream", create_stream)
+    monkeypatch.setattr(streaming, "scheduler", scheduler)
+    monkeypatch.setattr(streaming, "writer", writer)
+    monkeypatch.setattr(streaming, "charge_completion_tokens", lambda user_id, tokens: None)
+    cancelled = streaming.stream_stats["cancelled"]
+
+    async def scenario():
+        request = FakeRequest()
+        reply = await streaming.open_reply(MESSAGES, "m")
+        events = streaming.stream_generator(request, reply, MESSAGES, "m", "c1", "u1")
+        frames = [await events.__anext__(), await events.__anext__()]
+        request.disconnected = True
+        frames.extend([frame async for frame in events])
+        await streaming.flush_turns()
+        await asyncio.sleep(0)
+        return frames
+
+    frames = asyncio.run(scenario())
+
+    assert streams[0].closed
+    assert scheduler._lane("m").active == 0
+    assert streaming.stream_stats["cancelled"] == cancelled + 1
+    assert not any(b"message_stop" in frame for frame in frames)
+    user_row, reply_row = writer.rows
+    assert user_row["content"] == "hello"
+    assert reply_row["is_truncated"]
+    assert reply_row["content"].startswith("part0 ")
+    assert len(reply_row["content"].split()) < 50
+
+
+def test_completed_turn_is_cached_before_message_stop(monkeypatch):
+    history_cache = HistoryCache(SQLiteStore(":memory:"))
+    monkeypatch.setattr(streaming, "history_cache", history_cache)
+    monkeypatch.setattr(streaming, "writer", FakeWriter())
+    monkeypatch.setattr(streaming, "charge_completion_tokens", lambda user_id, tokens: None)
+
+    async def scenario():
+        await history_cache.load("c1")
+        reply = streaming.Reply.replay(["Hel", "lo"])
+        async for frame in streaming.stream_generator(FakeRequest(), reply, MESSAGES, "m", "c1", "u1"):
+            if b"message_stop" in frame:
+                return [row["content"] for row in history_cache._entries["c1"].messages]
+
+    assert asyncio.run(scenario()) == ["hello", "Hello"]